@@ -1,49 +1,66 @@
 from http.server import BaseHTTPRequestHandler
-import json
 import os
 import asyncio
 import aiohttp
+import logging
 from urllib.parse import quote
-import hashlib
-import hmac
 import time
 
+# Shared root modules are bundled with this function (includeFiles in vercel.json)
+# and imported from the project root, which the Python runtime puts on sys.path
+from json_backend import dumps
+from resilience import Deadline, Resilience, bot_api_error, get_file, upstream_key
+from updates import WebhookUpdate
+
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+OK_BODY = dumps({"ok": True})
+# Telegram waits for the webhook response, so answer well inside its timeout
+WEBHOOK_DEADLINE = float(os.getenv('WEBHOOK_DEADLINE', '8'))
+# Seconds of the deadline kept back so a failed lookup can still be answered
+REPLY_RESERVE = 2.0
+# Breaker state survives between invocations of a warm instance
+RESILIENCE = Resilience()
+
+logger = logging.getLogger(__name__)
+
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
             # Read the request body
             content_length = int(self.headers['Content-Length'])
             body = self.rfile.read(content_length)
+            deadline = Deadline(WEBHOOK_DEADLINE)
             
-            # Parse Telegram update
-            update = json.loads(body.decode('utf-8'))
+            # Parse only the Telegram updates we act on
+            update = WebhookUpdate.from_body(body)
             
-            # Process the update
-            asyncio.run(self.process_update(update))
+            # Process the update; Telegram redelivers anything not answered
+            # with 200, which would repeat lookups and replies
+            if update is not None:
+                try:
+                    asyncio.run(self.process_update(update, deadline))
+                except Exception as e:
+                    logger.error("Error processing update for %s: %s", update.chat_id, e)
             
             # Send response
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
-            self.wfile.write(json.dumps({"ok": True}).encode())
+            self.wfile.write(OK_BODY)
             
         except Exception as e:
             self.send_response(500)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
-            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            self.wfile.write(dumps({"error": str(e)}))
 
-    async def process_update(self, update):
+    async def process_update(self, update: WebhookUpdate, deadline: Deadline):
         """Process Telegram webhook update"""
-        if 'message' not in update:
-            return
-        
-        message = update['message']
-        chat_id = message['chat']['id']
+        chat_id = update.chat_id
         bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
         
         # Handle /start command
-        if message.get('text') == '/start':
+        if update.text == '/start':
             welcome_text = """
 🤖 **Welcome to File Link Generator Bot!**
 
@@ -63,38 +80,20 @@ Send me any file and I'll generate streaming and download links for you.
 
 Just drop your file and I'll handle the rest! 📁✨
             """
-            await self.send_message(chat_id, welcome_text, bot_token)
+            await self.send_message(chat_id, welcome_text, bot_token, deadline)
             return
         
         # Handle file uploads
-        file_info = None
-        file_name = "file"
-        
-        if 'document' in message:
-            file_info = message['document']
-            file_name = file_info.get('file_name', f"document_{file_info['file_id']}.bin")
-        elif 'video' in message:
-            file_info = message['video']
-            file_name = file_info.get('file_name', f"video_{file_info['file_id']}.mp4")
-        elif 'audio' in message:
-            file_info = message['audio']
-            file_name = file_info.get('file_name', f"audio_{file_info['file_id']}.mp3")
-        elif 'photo' in message:
-            # Get the largest photo
-            file_info = max(message['photo'], key=lambda x: x.get('file_size', 0))
-            file_name = f"photo_{file_info['file_id']}.jpg"
-        elif 'animation' in message:
-            file_info = message['animation']
-            file_name = file_info.get('file_name', f"animation_{file_info['file_id']}.gif")
-        
-        if not file_info:
-            await self.send_message(chat_id, "❌ Unsupported file type.", bot_token)
+        descriptor = update.file
+        if not descriptor:
+            await self.send_message(chat_id, "❌ Unsupported file type.", bot_token, deadline)
             return
         
         # Get file path from Telegram
-        file_path = await self.get_file_path(file_info['file_id'], bot_token)
+        lookup_deadline = Deadline(max(deadline.remaining() - REPLY_RESERVE, 0.5))
+        file_path = await self.get_file_path(descriptor.file_id, bot_token, lookup_deadline)
         if not file_path:
-            await self.send_message(chat_id, "❌ Could not get file information.", bot_token)
+            await self.send_message(chat_id, "❌ Could not get file information.", bot_token, deadline)
             return
         
         # Generate URLs
@@ -102,12 +101,12 @@ Just drop your file and I'll handle the rest! 📁✨
         if not base_url.startswith('http'):
             base_url = f'https://{base_url}'
             
-        stream_url = self.generate_stream_url(file_info['file_id'], file_name, base_url)
-        download_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
+        stream_url = self.generate_stream_url(descriptor, base_url)
+        download_url = f"{TELEGRAM_API_URL}/file/bot{bot_token}/{file_path}"
         
         # Format file size
-        file_size = file_info.get('file_size', 0)
-        size_str = self.format_file_size(file_size)
+        file_name = descriptor.file_name
+        size_str = descriptor.size_label
         
         response_text = f"""
 ✅ **File processed successfully!**
@@ -130,54 +129,51 @@ Just drop your file and I'll handle the rest! 📁✨
 *Tap to copy the links above* 📋
         """
         
-        await self.send_message(chat_id, response_text, bot_token)
+        await self.send_message(chat_id, response_text, bot_token, deadline)
 
-    async def send_message(self, chat_id, text, bot_token):
+    async def send_message(self, chat_id, text, bot_token, deadline):
         """Send message via Telegram Bot API"""
         async with aiohttp.ClientSession() as session:
-            url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+            url = f"{TELEGRAM_API_URL}/bot{bot_token}/sendMessage"
             data = {
                 'chat_id': chat_id,
                 'text': text,
                 'parse_mode': 'Markdown'
             }
-            await session.post(url, json=data)
+            
+            async def attempt():
+                async with session.post(url, data=dumps(data), headers={'Content-Type': 'application/json'}) as resp:
+                    # Rejected messages are not retried; throttling and outages are
+                    if resp.status == 429 or resp.status >= 500:
+                        raise await bot_api_error(resp)
+            
+            # Not idempotent: only retried when Telegram cannot have sent it
+            try:
+                await RESILIENCE.call('sendMessage', attempt, deadline)
+            except Exception as e:
+                logger.error("Error sending message to %s: %s", chat_id, e)
 
-    async def get_file_path(self, file_id, bot_token):
+    async def get_file_path(self, file_id, bot_token, deadline):
         """Get file path from Telegram API"""
-        async with aiohttp.ClientSession() as session:
-            url = f"https://api.telegram.org/bot{bot_token}/getFile"
-            params = {'file_id': file_id}
-            async with session.get(url, params=params) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    if data.get('ok'):
-                        return data['result'].get('file_path')
-        return None
-
-    def generate_stream_url(self, file_id, file_name, base_url):
+        try:
+            async with aiohttp.ClientSession() as session:
+                result = await RESILIENCE.call(
+                    upstream_key(file_id),
+                    lambda: get_file(session, TELEGRAM_API_URL, bot_token, file_id),
+                    deadline,
+                    idempotent=True
+                )
+            return result.get('file_path')
+        except Exception as e:
+            logger.error("Error getting file path for %s: %s", file_id, e)
+            return None
+
+    def generate_stream_url(self, descriptor, base_url):
         """Generate streaming URL"""
         timestamp = str(int(time.time()))
         url_secret = os.getenv('URL_SECRET', 'default-secret')
         
-        hash_string = f"{file_id}:{timestamp}:{url_secret}"
-        url_hash = hmac.new(
-            url_secret.encode(),
-            hash_string.encode(),
-            hashlib.sha256
-        ).hexdigest()[:16]
+        url_hash = descriptor.signature(timestamp, url_secret)
         
-        encoded_filename = quote(file_name)
-        return f"{base_url}/watch/{file_id}/{encoded_filename}?hash={url_hash}&t={timestamp}"
-
-    def format_file_size(self, size_bytes):
-        """Format file size"""
-        if size_bytes == 0:
-            return "0 B"
-        size_names = ["B", "KB", "MB", "GB"]
-        i = 0
-        size_float = float(size_bytes)
-        while size_float >= 1024 and i < len(size_names) - 1:
-            size_float /= 1024.0
-            i += 1
-        return f"{size_float:.1f} {size_names[i]}"
\ No newline at end of file
+        encoded_filename = quote(descriptor.file_name)
+        return f"{base_url}/watch/{descriptor.file_id}/{encoded_filename}?hash={url_hash}&t={timestamp}"
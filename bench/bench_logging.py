@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Event-loop stall benchmark for logging
+Logs a mix of success and error records from coroutines while a monitor task
+measures how late the loop wakes it, comparing synchronous handlers with the
+queue-backed setup from log_config
+"""
+
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import log_config
+from bench import harness
+from bench.run_bench import percentile
+
+TOKEN_URL = "https://api.telegram.org/bot123456789:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw/getFile"
+
+class SlowStream:
+    """File stream whose writes take a fixed extra time, like a busy log pipe"""
+
+    def __init__(self, path: str, delay_ms: float):
+        self.file = open(path, 'w')
+        self.delay = delay_ms / 1000
+
+    def write(self, data: str):
+        if self.delay:
+            time.sleep(self.delay)
+        self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def configure(mode: str, stream: SlowStream, queue_size: int):
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    log_config.stop_logging()
+    if mode == 'sync':
+        # What logging.basicConfig gave every module before
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+    else:
+        rate = 1.0 if mode == 'queue' else 0.1
+        log_config.setup_logging('INFO', 'text', rate, stream, queue_size)
+
+async def workload(records: int, workers: int, monitor_interval_ms: float) -> Dict:
+    logger = logging.getLogger('bench')
+    lags: List[float] = []
+    done = asyncio.Event()
+
+    async def monitor():
+        interval = monitor_interval_ms / 1000
+        while not done.is_set():
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            lags.append(max(time.perf_counter() - expected, 0) * 1000)
+
+    async def worker(offset: int):
+        for i in range(offset, records, workers):
+            if i % 50 == 0:
+                try:
+                    raise ConnectionError(f"Cannot connect to {TOKEN_URL}")
+                except ConnectionError:
+                    logger.error("Error getting file path for %s", i, exc_info=True)
+            else:
+                logger.info("Streaming %s (%d)", i, 206, extra={'sampled': True})
+            await asyncio.sleep(0)
+
+    monitor_task = asyncio.create_task(monitor())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(workers)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await monitor_task
+    return {
+        "records": records,
+        "loop_elapsed_s": round(elapsed, 4),
+        "records_per_s": round(records / elapsed, 1),
+        "stall_ms": {
+            "p50": round(percentile(lags, 50), 3),
+            "p99": round(percentile(lags, 99), 3),
+            "max": round(max(lags), 3) if lags else 0.0,
+        },
+    }
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    parser = harness.parser("Measure event-loop stalls caused by logging")
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--sink-delay-ms', type=float, default=0.2, help="Extra time per log write")
+    parser.add_argument('--monitor-interval-ms', type=float, default=1.0)
+    parser.add_argument('--queue-size', type=int, default=log_config.DEFAULT_QUEUE_SIZE)
+    args = parser.parse_args(argv)
+
+    report = {"params": vars(args), "modes": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('sync', 'queue', 'queue_sampled'):
+            path = os.path.join(tmp, f"{mode}.log")
+            stream = SlowStream(path, args.sink_delay_ms)
+            configure(mode, stream, args.queue_size)
+            result = asyncio.run(workload(args.records, args.workers, args.monitor_interval_ms))
+            result["dropped"] = log_config.dropped_records()
+            flush_started = time.perf_counter()
+            log_config.stop_logging()
+            result["drain_after_s"] = round(time.perf_counter() - flush_started, 4)
+            stream.close()
+            with open(path) as f:
+                content = f.read()
+            result["lines_written"] = content.count('\n')
+            result["token_leaked"] = '123456789:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw' in content
+            report["modes"][mode] = result
+
+    sync_p99 = report["modes"]["sync"]["stall_ms"]["p99"]
+    for mode in ('queue', 'queue_sampled'):
+        p99 = report["modes"][mode]["stall_ms"]["p99"]
+        report["modes"][mode]["p99_stall_reduction_pct"] = round((1 - p99 / sync_p99) * 100, 1) if sync_p99 else None
+
+    return harness.emit(report, args.output)
+
+if __name__ == "__main__":
+    harness.run(main)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Webhook update parsing microbenchmark
+Compares the previous decode + json.loads + dict walk path with
+WebhookUpdate.from_body over recorded update fixtures
+"""
+
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from bench import harness
+import json_backend
+from updates import WebhookUpdate
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'updates.json')
+
+def load_bodies(path: str = FIXTURES) -> List[bytes]:
+    """Recorded updates re-encoded compactly, as Telegram sends them"""
+    with open(path, encoding='utf-8') as f:
+        return [json.dumps(u, ensure_ascii=False, separators=(',', ':')).encode('utf-8') for u in json.load(f)]
+
+def parse_baseline(body: bytes):
+    """The webhook's original parsing path"""
+    update = json.loads(body.decode('utf-8'))
+    if 'message' not in update:
+        return None
+    message = update['message']
+    chat_id = message['chat']['id']
+    file_info = None
+    if 'document' in message:
+        file_info = message['document']
+    elif 'video' in message:
+        file_info = message['video']
+    elif 'audio' in message:
+        file_info = message['audio']
+    elif 'photo' in message:
+        file_info = max(message['photo'], key=lambda x: x.get('file_size', 0))
+    elif 'animation' in message:
+        file_info = message['animation']
+    return chat_id, message.get('text'), file_info
+
+def measure(parse: Callable, bodies: List[bytes], rounds: int) -> Dict:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for body in bodies:
+            parse(body)
+    elapsed = time.perf_counter() - started
+    count = rounds * len(bodies)
+    return {
+        "updates": count,
+        "elapsed_s": round(elapsed, 4),
+        "updates_per_s": round(count / elapsed, 1),
+        "ns_per_update": round(elapsed / count * 1e9, 1),
+    }
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    parser = harness.parser("Benchmark webhook update parsing")
+    parser.add_argument('--rounds', type=int, default=20000)
+    parser.add_argument('--fixtures', default=FIXTURES)
+    args = parser.parse_args(argv)
+
+    bodies = load_bodies(args.fixtures)
+    baseline = measure(parse_baseline, bodies, args.rounds)
+    current = measure(WebhookUpdate.from_body, bodies, args.rounds)
+    report = {
+        "json_backend": "orjson" if json_backend.orjson is not None else "json",
+        "fixtures": len(bodies),
+        "baseline": baseline,
+        "webhook_update": current,
+        "speedup": round(baseline["elapsed_s"] / current["elapsed_s"], 2),
+    }
+
+    return harness.emit(report, args.output)
+
+if __name__ == "__main__":
+    harness.run(main)
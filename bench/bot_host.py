@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Local host for the bot's message handlers
+Feeds Bot API-shaped updates to bot.py as stub Pyrogram messages, so
+benchmarks can drive process_file_message and /batch as a separate process
+(python -m bench.bot_host). Nothing connects to Telegram over MTProto; getFile
+goes to TELEGRAM_API_URL and replies are collected from the stub messages
+"""
+
+import argparse
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from bot import bot
+from file_descriptor import MEDIA_KINDS
+
+class StubMessage:
+    """The parts of a Pyrogram Message the bot's handlers use"""
+
+    def __init__(self, chat_id: int, message_id: int, replies: List[str], command: Optional[List[str]] = None):
+        self.chat = SimpleNamespace(id=chat_id)
+        self.id = message_id
+        self.command = command
+        self.empty = False
+        self.replies = replies
+        for kind in MEDIA_KINDS:
+            setattr(self, kind, None)
+
+    @classmethod
+    def from_update(cls, update: Dict[str, Any], replies: List[str]) -> "StubMessage":
+        message = update['message']
+        stub = cls(message['chat']['id'], message['message_id'], replies)
+        for kind in MEDIA_KINDS:
+            media = message.get(kind)
+            if media:
+                if kind == 'photo':
+                    # Pyrogram exposes only the largest photo size
+                    media = max(media, key=lambda size: size.get('file_size', 0))
+                setattr(stub, kind, SimpleNamespace(**media))
+        return stub
+
+    async def reply_text(self, text: str, **kwargs) -> "StubMessage":
+        self.replies.append(text)
+        # /batch edits its progress into the reply it sent first
+        return StubMessage(self.chat.id, 0, self.replies)
+
+    async def edit_text(self, text: str, **kwargs):
+        self.replies.append(text)
+
+    async def reply_document(self, document, caption: str = '', **kwargs):
+        self.replies.append(caption)
+
+async def handle_message(request: web.Request) -> web.Response:
+    """Answer one file message the way the bot's file handler does"""
+    replies: List[str] = []
+    await bot.process_file_message(StubMessage.from_update(await request.json(), replies))
+    return web.json_response({"replies": replies})
+
+async def handle_batch(request: web.Request) -> web.Response:
+    """Send /batch, forward every update in the body, then send /done"""
+    body = await request.json()
+    chat_id = body['chat_id']
+    replies: List[str] = []
+    await bot.start_batch(StubMessage(chat_id, 0, replies, command=['batch']))
+    for update in body['updates']:
+        await bot.collect_batch_file(bot.batch_sessions[chat_id], StubMessage.from_update(update, replies))
+    await bot.finish_batch(StubMessage(chat_id, 0, replies, command=['done']))
+    return web.json_response({"replies": replies})
+
+async def close_bot(app: web.Application):
+    bot.link_index.close()
+    if bot.http_session and not bot.http_session.closed:
+        await bot.http_session.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the bot's message handlers locally")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8083)
+    args = parser.parse_args(argv)
+
+    app = web.Application()
+    app.router.add_post('/message', handle_message)
+    app.router.add_post('/batch', handle_batch)
+    app.on_cleanup.append(close_bot)
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
+
+if __name__ == "__main__":
+    main()
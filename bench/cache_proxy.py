@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+HTTP caching check through a local caching proxy
+Puts a minimal shared cache (max-age freshness, If-None-Match revalidation)
+in front of the web server and checks that repeat player and file traffic is
+absorbed by it, and that the server answers conditional requests correctly
+"""
+
+import argparse
+import asyncio
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+from multidict import CIMultiDict
+
+from bench import harness
+from bench.fake_telegram import file_bytes
+from bench.run_bench import BenchEnvironment, parse_args as parse_bench_args
+
+MAX_AGE = re.compile(r'max-age=(\d+)')
+# Hop-by-hop and length headers are recomputed by the proxy
+SKIP_HEADERS = frozenset(('content-length', 'transfer-encoding', 'connection', 'content-encoding'))
+
+class CachingProxy:
+    """Shared cache keyed by URL and Range that honours Cache-Control and ETag"""
+
+    def __init__(self, origin: str, ignore_max_age: bool = False):
+        self.origin = origin
+        # Treat every entry as stale, to exercise revalidation
+        self.ignore_max_age = ignore_max_age
+        self.entries: Dict[Tuple[str, str], Dict] = {}
+        self.stats = {"hit": 0, "miss": 0, "revalidated": 0}
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    async def start(self) -> str:
+        self.session = aiohttp.ClientSession()
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{self.runner.addresses[0][1]}"
+        return self.url
+
+    async def stop(self):
+        await self.session.close()
+        await self.runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        key = (request.path_qs, request.headers.get('Range', ''))
+        entry = self.entries.get(key)
+        headers = {'Range': key[1]} if key[1] else {}
+
+        if entry and not self.ignore_max_age and time.monotonic() < entry["expires"]:
+            self.stats["hit"] += 1
+            return self.reply(entry, "HIT")
+
+        if entry and entry["headers"].get('ETag'):
+            headers['If-None-Match'] = entry["headers"]['ETag']
+
+        async with self.session.get(f"{self.origin}{request.path_qs}", headers=headers, allow_redirects=False) as resp:
+            body = await resp.read()
+            resp_headers = CIMultiDict((k, v) for k, v in resp.headers.items() if k.lower() not in SKIP_HEADERS)
+            if resp.status == 304 and entry:
+                self.stats["revalidated"] += 1
+                entry["expires"] = self.expiry(resp_headers)
+                return self.reply(entry, "REVALIDATED")
+
+        self.stats["miss"] += 1
+        entry = {"status": resp.status, "headers": resp_headers, "body": body, "expires": self.expiry(resp_headers)}
+        cache_control = resp_headers.get('Cache-Control', '')
+        if resp.status in (200, 206) and 'public' in cache_control:
+            self.entries[key] = entry
+        return self.reply(entry, "MISS")
+
+    def expiry(self, headers: CIMultiDict) -> float:
+        match = MAX_AGE.search(headers.get('Cache-Control', ''))
+        return time.monotonic() + (int(match.group(1)) if match else 0)
+
+    def reply(self, entry: Dict, status: str) -> web.Response:
+        headers = CIMultiDict(entry["headers"])
+        headers['X-Cache'] = status
+        return web.Response(status=entry["status"], headers=headers, body=entry["body"])
+
+async def conditional_checks(env: BenchEnvironment, range_size: int) -> Dict[str, bool]:
+    """Talk to the server directly and check conditional request handling"""
+    fake = env.fake
+    checks = {}
+    async with aiohttp.ClientSession() as session:
+        url = env.watch_url("C1", "clip.mp4").replace('/watch/', '/stream/')
+        async with session.get(url, headers={'Range': f"bytes=0-{range_size - 1}"}) as resp:
+            await resp.read()
+            etag = resp.headers.get('ETag')
+            checks["stream_has_validators"] = (
+                resp.status == 206 and bool(etag)
+                and 'immutable' in resp.headers.get('Cache-Control', '')
+                and resp.headers.get('Accept-Ranges') == 'bytes'
+            )
+        # The stand-in's getFile reports file_unique_id "u" + file_id
+        checks["etag_from_file_unique_id"] = etag == '"uC1"'
+
+        async with session.head(url) as resp:
+            body = await resp.read()
+            checks["stream_head"] = (
+                resp.status == 200 and resp.headers.get('ETag') == etag and body == b''
+                and resp.headers.get('Content-Length') == str(fake.file_size)
+            )
+
+        fetches = fake.requests["file"]
+        async with session.get(url, headers={'If-None-Match': etag}) as resp:
+            checks["if_none_match_304"] = resp.status == 304 and resp.headers.get('ETag') == etag
+        checks["304_skips_upstream_bytes"] = fake.requests["file"] == fetches
+
+        async with session.get(url, headers={'If-None-Match': f'W/{etag}, "other"'}) as resp:
+            checks["weak_if_none_match_list_304"] = resp.status == 304
+
+        start, end = 1000, 1000 + range_size - 1
+        async with session.get(url, headers={'Range': f"bytes={start}-{end}", 'If-Range': etag}) as resp:
+            body = await resp.read()
+            checks["if_range_match_206"] = resp.status == 206 and body == file_bytes(start, end)
+
+        async with session.get(url, headers={'Range': f"bytes={start}-{end}", 'If-Range': '"stale"'}) as resp:
+            await resp.read()
+            checks["if_range_mismatch_200"] = resp.status == 200
+
+        page = env.watch_url("C1", "clip.mp4")
+        async with session.get(page) as resp:
+            await resp.read()
+            page_etag = resp.headers.get('ETag')
+        async with session.get(page, headers={'If-None-Match': page_etag}) as resp:
+            checks["player_if_none_match_304"] = bool(page_etag) and resp.status == 304
+        async with session.head(page) as resp:
+            checks["player_head"] = resp.status == 200 and resp.headers.get('ETag') == page_etag
+    return checks
+
+async def proxy_traffic(env: BenchEnvironment, args: argparse.Namespace, ignore_max_age: bool) -> Dict:
+    """Repeat player and range traffic through the caching proxy"""
+    proxy = CachingProxy(env.server_url, ignore_max_age)
+    proxy_url = await proxy.start()
+    env.fake.requests.clear()
+    pages = [env.watch_url(f"P{i}", f"clip_{i}.mp4") for i in range(args.files)]
+    streams = [p.replace('/watch/', '/stream/') for p in pages]
+    ranged = {'Range': f"bytes=0-{args.range_size - 1}"}
+    try:
+        async with aiohttp.ClientSession() as session:
+            for _ in range(args.repeats):
+                for page, stream in zip(pages, streams):
+                    async with session.get(page.replace(env.server_url, proxy_url)) as resp:
+                        await resp.read()
+                    async with session.get(stream.replace(env.server_url, proxy_url), headers=ranged) as resp:
+                        await resp.read()
+    finally:
+        await proxy.stop()
+
+    total = args.files * args.repeats * 2
+    return {
+        "requests": total,
+        "cache": dict(proxy.stats),
+        "hit_ratio": round((proxy.stats["hit"] + proxy.stats["revalidated"]) / total, 3),
+        "upstream_file_fetches": env.fake.requests["file"],
+    }
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    parser = harness.parser("Check HTTP caching through a local caching proxy")
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--range-size', type=int, default=64 * 1024)
+    args = parser.parse_args(argv)
+
+    env = BenchEnvironment(parse_bench_args(['--file-size', str(1024 * 1024)]))
+    env.start()
+    try:
+        checks = asyncio.run(conditional_checks(env, args.range_size))
+        fresh = asyncio.run(proxy_traffic(env, args, ignore_max_age=False))
+        revalidating = asyncio.run(proxy_traffic(env, args, ignore_max_age=True))
+    finally:
+        env.stop()
+
+    # Fresh entries are served from cache; stale ones revalidate without refetching bytes
+    checks["proxy_absorbs_repeats"] = fresh["cache"]["miss"] == args.files * 2
+    checks["file_bytes_fetched_once_per_file"] = fresh["upstream_file_fetches"] == args.files
+    checks["stale_entries_revalidate"] = revalidating["cache"]["revalidated"] == args.files * 2 * (args.repeats - 1)
+    checks["revalidation_skips_upstream_bytes"] = revalidating["upstream_file_fetches"] == args.files
+
+    report = {
+        "params": vars(args),
+        "fresh": fresh,
+        "revalidating": revalidating,
+    }
+    return harness.emit(harness.with_checks(report, checks), args.output)
+
+if __name__ == "__main__":
+    harness.run(main)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Local Telegram stand-in for benchmarks
+Serves the Bot API methods and file endpoint used by the bot, the web server
+and the webhook, with deterministic file bytes and injectable latency/errors
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+from collections import Counter
+from typing import Dict, Optional, Set
+from aiohttp import web
+
+# File content is a repeating pattern with a prime period, so any byte range
+# can be generated and verified without keeping whole files in memory
+PATTERN_PERIOD = 251
+PATTERN = bytes((i * 131 + 7) % 256 for i in range(PATTERN_PERIOD))
+CHUNK_SIZE = 64 * 1024
+DEFAULT_FILE_SIZE = 16 * 1024 * 1024
+
+def file_bytes(start: int, end: int) -> bytes:
+    """Return the deterministic content for the inclusive range [start, end]"""
+    length = end - start + 1
+    offset = start % PATTERN_PERIOD
+    repeats = (offset + length) // PATTERN_PERIOD + 1
+    return (PATTERN * repeats)[offset:offset + length]
+
+class FakeTelegram:
+    """Bot API stand-in running on its own event loop thread"""
+
+    def __init__(self, file_size: int = DEFAULT_FILE_SIZE, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0, seed: int = 0,
+                 chunk_delay_ms: float = 0.0, stall_rate: float = 0.0, stall_ms: float = 0.0):
+        self.file_size = file_size
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        # Pause between file chunks, to simulate slow long-running downloads
+        self.chunk_delay_ms = chunk_delay_ms
+        # Fraction of requests held for stall_ms, for a long latency tail
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+        # Extra latency and error rates overriding error_rate for single
+        # routes, e.g. {"getFile": 500}
+        self.route_latency_ms: Dict[str, float] = {}
+        self.route_error_rate: Dict[str, float] = {}
+        self.rng = random.Random(seed)
+        self.requests: Counter = Counter()
+        self.message_id = 0
+        # file_path handed out by getFile, per file_id; only these are served
+        self.file_paths: Dict[str, str] = {}
+        self.issued_paths: Set[str] = set()
+        self.url: Optional[str] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.runner: Optional[web.AppRunner] = None
+        self.thread: Optional[threading.Thread] = None
+
+        self.app = web.Application()
+        self.app.router.add_get(r'/bot{token}/getFile', self.get_file)
+        self.app.router.add_post(r'/bot{token}/sendMessage', self.send_message)
+        self.app.router.add_post(r'/bot{token}/editMessageText', self.send_message)
+        self.app.router.add_get(r'/file/bot{token}/{file_path:.+}', self.serve_file)
+
+    async def inject(self, route: str) -> Optional[web.Response]:
+        """Apply configured latency and return an error response when one is injected"""
+        self.requests[route] += 1
+        delay = self.latency_ms + self.route_latency_ms.get(route, 0.0)
+        delay += self.rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0
+        if self.stall_rate and self.rng.random() < self.stall_rate:
+            delay += self.stall_ms
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        error_rate = self.route_error_rate.get(route, self.error_rate)
+        if error_rate and self.rng.random() < error_rate:
+            self.requests[f"{route}:error"] += 1
+            if self.rng.random() < 0.5:
+                return web.json_response(
+                    {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                     "parameters": {"retry_after": 1}},
+                    status=429
+                )
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500)
+        return None
+
+    async def get_file(self, request: web.Request) -> web.Response:
+        error = await self.inject("getFile")
+        if error:
+            return error
+        file_id = request.query.get('file_id', '')
+        # Like Telegram's, paths are opaque and cannot be derived from the file_id
+        file_path = self.file_paths.setdefault(file_id, f"documents/file_{len(self.file_paths)}.bin")
+        self.issued_paths.add(file_path)
+        return web.json_response({
+            "ok": True,
+            "result": {
+                "file_id": file_id,
+                "file_unique_id": f"u{file_id}",
+                "file_size": self.file_size,
+                "file_path": file_path
+            }
+        })
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        error = await self.inject("sendMessage")
+        if error:
+            return error
+        data = await request.json()
+        self.message_id += 1
+        return web.json_response({
+            "ok": True,
+            "result": {"message_id": self.message_id, "chat": {"id": data.get('chat_id')}, "text": data.get('text', '')}
+        })
+
+    async def serve_file(self, request: web.Request) -> web.StreamResponse:
+        error = await self.inject("file")
+        if error:
+            return error
+        if request.match_info['file_path'] not in self.issued_paths:
+            self.requests["file:unknown"] += 1
+            return web.json_response({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+
+        start, end = 0, self.file_size - 1
+        status = 200
+        range_header = request.headers.get('Range')
+        if range_header:
+            try:
+                units, spec = range_header.split('=', 1)
+                first, last = spec.split(',')[0].split('-')
+                if units.strip() != 'bytes':
+                    raise ValueError(units)
+                if first:
+                    start = int(first)
+                    end = min(int(last), self.file_size - 1) if last else self.file_size - 1
+                else:
+                    start = max(self.file_size - int(last), 0)
+                if start > end or start >= self.file_size:
+                    raise ValueError(range_header)
+                status = 206
+            except ValueError:
+                return web.Response(status=416, headers={'Content-Range': f"bytes */{self.file_size}"})
+
+        response = web.StreamResponse(status=status, headers={
+            'Content-Type': 'application/octet-stream',
+            'Content-Length': str(end - start + 1),
+            'Accept-Ranges': 'bytes',
+        })
+        if status == 206:
+            response.headers['Content-Range'] = f"bytes {start}-{end}/{self.file_size}"
+        await response.prepare(request)
+        position = start
+        try:
+            while position <= end:
+                chunk_end = min(position + CHUNK_SIZE - 1, end)
+                await response.write(file_bytes(position, chunk_end))
+                position = chunk_end + 1
+                if self.chunk_delay_ms:
+                    await asyncio.sleep(self.chunk_delay_ms / 1000)
+            await response.write_eof()
+        except ConnectionResetError:
+            # The reader went away mid-download, e.g. a drained proxy stream
+            self.requests["file:aborted"] += 1
+        return response
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Start serving in a background thread and return the base URL"""
+        ready = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.runner = web.AppRunner(self.app, access_log=None)
+            self.loop.run_until_complete(self.runner.setup())
+            site = web.TCPSite(self.runner, host, port)
+            self.loop.run_until_complete(site.start())
+            bound_port = self.runner.addresses[0][1]
+            self.url = f"http://{host}:{bound_port}"
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self.url
+
+    def stop(self):
+        """Stop the background server"""
+        if not self.loop:
+            return
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local Telegram Bot API stand-in")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--file-size', type=int, default=DEFAULT_FILE_SIZE)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-delay-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.file_size, args.latency_ms, args.jitter_ms, args.error_rate, args.seed, args.chunk_delay_ms)
+    url = fake.start(args.host, args.port)
+    print(json.dumps({"url": url}))
+    try:
+        fake.thread.join()
+    except KeyboardInterrupt:
+        fake.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Shared plumbing for the bench scripts
+Scripts are run from the repository root as modules (python -m bench.<name>)
+and share argument parsing, JSON report output and pass/fail handling
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Callable, Dict, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parser(description: str) -> argparse.ArgumentParser:
+    """Argument parser with the --output option every script takes"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    return parser
+
+def with_checks(report: Dict, checks: Dict[str, bool]) -> Dict:
+    """Attach named checks and an overall passed flag to a report"""
+    report["checks"] = checks
+    report["passed"] = all(checks.values())
+    return report
+
+def emit(report: Dict, output: Optional[str] = None) -> Dict:
+    """Print a report as JSON, also writing it to output if given"""
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    print(text)
+    return report
+
+def run(main: Callable[[], Dict]):
+    """Script entry point: exit non-zero when the report's checks failed"""
+    report = main()
+    sys.exit(0 if report.get("passed", True) else 1)
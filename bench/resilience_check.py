@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Resilience check against the fault-injecting Telegram stand-in
+Compares getFile success with and without retries under injected errors,
+checks that a full outage trips the breaker instead of hammering Telegram and
+that it recovers, that a cancelled half-open probe does not wedge the breaker,
+and that hedging cuts the latency tail caused by stalls
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from bench import harness
+from bench.fake_telegram import FakeTelegram
+from bench.run_bench import BOT_TOKEN, BenchEnvironment, file_update, percentile
+from resilience import CircuitOpenError, Deadline, Resilience, get_file
+
+async def lookups(api_url: str, resilience: Optional[Resilience], calls: int, concurrency: int,
+                  deadline: float) -> Dict:
+    """Run getFile calls, directly or through the resilience layer"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    outcomes = {"ok": 0, "failed": 0, "circuit_open": 0}
+
+    async with aiohttp.ClientSession() as session:
+        async def lookup(i: int):
+            file_id = f"R{i}"
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    if resilience is None:
+                        await get_file(session, api_url, BOT_TOKEN, file_id)
+                    else:
+                        await resilience.call(
+                            'dc0',
+                            lambda: get_file(session, api_url, BOT_TOKEN, file_id),
+                            Deadline(deadline),
+                            idempotent=True
+                        )
+                    outcomes["ok"] += 1
+                except CircuitOpenError:
+                    outcomes["circuit_open"] += 1
+                except Exception:
+                    outcomes["failed"] += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(lookup(i) for i in range(calls)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        **outcomes,
+        "success_rate": round(outcomes["ok"] / calls, 3),
+        "elapsed_s": round(elapsed, 3),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p99": round(percentile(latencies, 99), 2),
+        },
+    }
+
+async def flaky(args: argparse.Namespace) -> Dict:
+    fake = FakeTelegram(error_rate=args.error_rate, latency_ms=5, seed=1)
+    url = fake.start()
+    try:
+        baseline = await lookups(url, None, args.calls, args.concurrency, args.deadline)
+        # A breaker that never trips, so only retries are measured
+        resilient = await lookups(url, Resilience(failure_threshold=10 ** 6, hedge=False),
+                                  args.calls, args.concurrency, args.deadline)
+    finally:
+        fake.stop()
+    return {"baseline": baseline, "resilient": resilient}
+
+async def outage(args: argparse.Namespace) -> Dict:
+    fake = FakeTelegram(error_rate=1.0, latency_ms=5, seed=2)
+    url = fake.start()
+    resilience = Resilience(failure_threshold=5, reset_timeout=args.reset_timeout, hedge=False)
+    try:
+        # Sequential, like a burst of users hitting a dead data center one by one
+        during = await lookups(url, resilience, args.calls, 1, 0.5)
+        upstream_calls = fake.requests["getFile"]
+        fake.error_rate = 0.0
+        await asyncio.sleep(args.reset_timeout)
+        after = await lookups(url, resilience, 20, 1, args.deadline)
+    finally:
+        fake.stop()
+    return {
+        "during": during,
+        "upstream_calls_during": upstream_calls,
+        "after_recovery": after,
+        "breaker_state": resilience.breaker('dc0').state,
+    }
+
+async def cancelled_probe(args: argparse.Namespace) -> Dict:
+    fake = FakeTelegram(error_rate=1.0, latency_ms=5, seed=4)
+    url = fake.start()
+    resilience = Resilience(failure_threshold=1, reset_timeout=args.reset_timeout, hedge=False)
+    breaker = resilience.breaker('dc0')
+    try:
+        await lookups(url, resilience, 1, 1, 0.5)
+        opened = breaker.state
+        await asyncio.sleep(args.reset_timeout)
+
+        # The probe stalls upstream and its caller gives up on it
+        fake.error_rate = 0.0
+        fake.stall_rate, fake.stall_ms = 1.0, 5000
+        probe = asyncio.ensure_future(lookups(url, resilience, 1, 1, args.deadline))
+        await asyncio.sleep(0.2)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        probing_after_cancel = breaker.probing
+
+        fake.stall_rate = 0.0
+        after = await lookups(url, resilience, 5, 1, args.deadline)
+    finally:
+        fake.stop()
+    return {
+        "opened": opened,
+        "probing_after_cancel": probing_after_cancel,
+        "after_cancel": after,
+        "breaker_state": breaker.state,
+    }
+
+async def failed_reply(args: argparse.Namespace) -> Dict:
+    env = BenchEnvironment(argparse.Namespace(file_size=1024, latency_ms=5, jitter_ms=0, error_rate=0.0, seed=5))
+    # Every reply fails; Telegram redelivers any update not answered with 200
+    env.fake.route_error_rate['sendMessage'] = 1.0
+    env.start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            statuses = []
+            for i in range(5):
+                async with session.post(env.webhook_url, json=file_update(i + 1)) as resp:
+                    statuses.append(resp.status)
+    finally:
+        env.stop()
+    return {"statuses": statuses, "reply_attempts": env.fake.requests['sendMessage']}
+
+async def tail(args: argparse.Namespace) -> Dict:
+    results = {}
+    for hedge in (False, True):
+        fake = FakeTelegram(latency_ms=5, stall_rate=args.stall_rate, stall_ms=args.stall_ms, seed=3)
+        url = fake.start()
+        resilience = Resilience(hedge=hedge)
+        try:
+            result = await lookups(url, resilience, args.calls, args.concurrency, args.deadline)
+        finally:
+            fake.stop()
+        result["hedges"] = resilience.hedges
+        result["upstream_calls"] = fake.requests["getFile"]
+        results["hedged" if hedge else "plain"] = result
+    return results
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    parser = harness.parser("Check retries, circuit breaking and hedging against injected faults")
+    parser.add_argument('--calls', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.2)
+    parser.add_argument('--deadline', type=float, default=10.0, help="Per-call deadline in seconds")
+    parser.add_argument('--reset-timeout', type=float, default=1.0)
+    parser.add_argument('--stall-rate', type=float, default=0.03)
+    parser.add_argument('--stall-ms', type=float, default=1000.0)
+    args = parser.parse_args(argv)
+    # Every injected fault would otherwise log a retry warning
+    logging.disable(logging.WARNING)
+
+    flaky_report = asyncio.run(flaky(args))
+    outage_report = asyncio.run(outage(args))
+    probe_report = asyncio.run(cancelled_probe(args))
+    reply_report = asyncio.run(failed_reply(args))
+    tail_report = asyncio.run(tail(args))
+
+    checks = {
+        "retries_raise_success_rate": flaky_report["resilient"]["success_rate"] >= 0.99
+            and flaky_report["resilient"]["success_rate"] > flaky_report["baseline"]["success_rate"],
+        # Threshold failures, plus the attempt that tripped it
+        "breaker_bounds_upstream_calls": outage_report["upstream_calls_during"] <= 6,
+        "breaker_fails_fast": outage_report["during"]["circuit_open"] >= args.calls - 6,
+        "breaker_recovers": outage_report["after_recovery"]["ok"] == 20 and outage_report["breaker_state"] == 'closed',
+        "cancelled_probe_released": probe_report["opened"] == 'open' and not probe_report["probing_after_cancel"]
+            and probe_report["after_cancel"]["ok"] == 5 and probe_report["breaker_state"] == 'closed',
+        "failed_reply_acknowledged": reply_report["statuses"] == [200] * 5 and reply_report["reply_attempts"] >= 5,
+        "hedging_cuts_p99": tail_report["hedged"]["latency_ms"]["p99"] < tail_report["plain"]["latency_ms"]["p99"] / 2,
+        "hedging_within_budget": tail_report["hedged"]["hedges"] <= args.calls // 10,
+    }
+    report = {
+        "params": vars(args),
+        "flaky": flaky_report,
+        "outage": outage_report,
+        "cancelled_probe": probe_report,
+        "failed_reply": reply_report,
+        "tail": tail_report,
+    }
+    return harness.emit(harness.with_checks(report, checks), args.output)
+
+if __name__ == "__main__":
+    harness.run(main)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Rolling restart simulation
+Starts an old and a new server instance against the local Telegram stand-in,
+sends SIGTERM to the old one while streams are active and checks that it
+drains: health flips to 503, new streams are refused with Retry-After, short
+streams finish, long streams are cut at the deadline and resume byte-exact on
+the new instance with Range. A stream still waiting on getFile when SIGTERM
+arrives must also hold the drain open and finish
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from bench import harness
+from bench.fake_telegram import FakeTelegram, file_bytes
+from bench.run_bench import BOT_TOKEN, URL_SECRET, free_port
+from file_descriptor import url_signature
+
+READ_SIZE = 64 * 1024
+
+def start_instance(port: int, fake_url: str, drain_timeout: float) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        TELEGRAM_API_URL=fake_url,
+        TELEGRAM_BOT_TOKEN=BOT_TOKEN,
+        URL_SECRET=URL_SECRET,
+        DRAIN_TIMEOUT=str(drain_timeout),
+        DRAIN_RETRY_AFTER='1',
+    )
+    return subprocess.Popen(
+        [sys.executable, 'server.py'], cwd=harness.ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+async def wait_healthy(session: aiohttp.ClientSession, base_url: str, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{base_url}/health") as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"{base_url} did not become healthy")
+
+def stream_path(file_id: str) -> str:
+    timestamp = str(int(time.time()))
+    return f"/stream/{file_id}/{file_id}.mp4?hash={url_signature(file_id, timestamp, URL_SECRET)}&t={timestamp}"
+
+async def stream(session: aiohttp.ClientSession, old_url: str, new_url: str, path: str,
+                 first: int, last: int, max_attempts: int = 10) -> Dict:
+    """Download [first, last] from the old instance, resuming on the new one after a cut"""
+    received = first
+    attempts = 0
+    verified = True
+    base_url = old_url
+    served_by: List[str] = []
+
+    while received <= last and attempts < max_attempts:
+        attempts += 1
+        headers = {'Range': f"bytes={received}-{last}"}
+        try:
+            async with session.get(f"{base_url}{path}", headers=headers) as resp:
+                if resp.status == 503:
+                    await asyncio.sleep(float(resp.headers.get('Retry-After', '1')) / 10)
+                    base_url = new_url
+                    continue
+                served_by.append('old' if base_url == old_url else 'new')
+                if resp.status != 206 or not resp.headers.get('Content-Range', '').startswith(f"bytes {received}-"):
+                    verified = False
+                    break
+                async for chunk in resp.content.iter_chunked(READ_SIZE):
+                    if chunk != file_bytes(received, received + len(chunk) - 1):
+                        verified = False
+                    received += len(chunk)
+        except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError):
+            pass
+        if received <= last:
+            # Cut by the drain deadline: resume where we stopped on the new instance
+            base_url = new_url
+
+    return {
+        "bytes": received - first,
+        "complete": received == last + 1,
+        "verified": verified and received == last + 1,
+        "served_by": served_by,
+    }
+
+async def pending_stream(session: aiohttp.ClientSession, fake: FakeTelegram, fake_url: str,
+                         args: argparse.Namespace) -> Dict:
+    """SIGTERM an instance whose only stream is still waiting on getFile"""
+    port = free_port()
+    proc = start_instance(port, fake_url, args.drain_timeout)
+    base_url = f"http://127.0.0.1:{port}"
+    health: Dict = {}
+    try:
+        await wait_healthy(session, base_url)
+        fake.route_latency_ms['getFile'] = args.drain_timeout * 1000 / 2
+        pending = asyncio.create_task(stream(session, base_url, base_url, stream_path('P0'), 0, args.short_size - 1))
+        await asyncio.sleep(0.3)
+        proc.send_signal(signal.SIGTERM)
+        await asyncio.sleep(0.2)
+        try:
+            async with session.get(f"{base_url}/health") as resp:
+                health = await resp.json()
+        except aiohttp.ClientError:
+            # Nothing held the drain open and the instance already stopped listening
+            pass
+        result = await pending
+        exit_code = await asyncio.get_running_loop().run_in_executor(None, proc.wait, args.drain_timeout + 10)
+    finally:
+        fake.route_latency_ms.pop('getFile', None)
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    return {"active_streams_while_draining": health.get('active_streams'), "stream": result, "exit_code": exit_code}
+
+async def simulate(args: argparse.Namespace) -> Dict:
+    fake = FakeTelegram(file_size=args.file_size, chunk_delay_ms=args.chunk_delay_ms)
+    fake_url = fake.start()
+    old_port, new_port = free_port(), free_port()
+    old = start_instance(old_port, fake_url, args.drain_timeout)
+    new = start_instance(new_port, fake_url, args.drain_timeout)
+    old_url, new_url = f"http://127.0.0.1:{old_port}", f"http://127.0.0.1:{new_port}"
+
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+            await wait_healthy(session, old_url)
+            await wait_healthy(session, new_url)
+
+            long_streams = [
+                asyncio.create_task(stream(session, old_url, new_url, stream_path(f"L{i}"), 0, args.file_size - 1))
+                for i in range(args.long_streams)
+            ]
+            short_streams = [
+                asyncio.create_task(stream(session, old_url, new_url, stream_path(f"S{i}"), 0, args.short_size - 1))
+                for i in range(args.short_streams)
+            ]
+            await asyncio.sleep(args.warmup)
+
+            old.send_signal(signal.SIGTERM)
+            signalled = time.monotonic()
+            await asyncio.sleep(0.2)
+
+            async with session.get(f"{old_url}/health") as resp:
+                health_status = resp.status
+            async with session.get(f"{old_url}{stream_path('N0')}") as resp:
+                refused_status = resp.status
+                retry_after = resp.headers.get('Retry-After')
+
+            long_results = await asyncio.gather(*long_streams)
+            short_results = await asyncio.gather(*short_streams)
+            exit_code = await asyncio.get_running_loop().run_in_executor(None, old.wait, args.drain_timeout + 10)
+            drain_s = time.monotonic() - signalled
+
+            pending = await pending_stream(session, fake, fake_url, args)
+    finally:
+        for proc in (old, new):
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        fake.stop()
+
+    checks = {
+        "health_not_ready": health_status == 503,
+        "new_streams_refused": refused_status == 503 and retry_after is not None,
+        "short_streams_finished_on_old": all(r["verified"] and r["served_by"] == ['old'] for r in short_results),
+        "long_streams_resumed_exactly": all(r["verified"] and 'new' in r["served_by"] for r in long_results),
+        "old_exited_cleanly": exit_code == 0,
+        "drained_within_deadline": drain_s <= args.drain_timeout + 6,
+        "pending_stream_held_drain": pending["active_streams_while_draining"] == 1
+            and pending["stream"]["verified"] and pending["stream"]["served_by"] == ['old'] and pending["exit_code"] == 0,
+    }
+    return harness.with_checks({
+        "params": vars(args),
+        "health_status_while_draining": health_status,
+        "refused_status": refused_status,
+        "retry_after": retry_after,
+        "drain_s": round(drain_s, 3),
+        "old_exit_code": exit_code,
+        "long_streams": long_results,
+        "short_streams": short_results,
+        "pending_stream": pending,
+    }, checks)
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    parser = harness.parser("Simulate a rolling restart under active streams")
+    parser.add_argument('--file-size', type=int, default=8 * 1024 * 1024)
+    parser.add_argument('--chunk-delay-ms', type=float, default=40.0, help="Upstream pause per 64 KiB chunk")
+    parser.add_argument('--long-streams', type=int, default=4)
+    parser.add_argument('--short-streams', type=int, default=4)
+    parser.add_argument('--short-size', type=int, default=256 * 1024)
+    parser.add_argument('--warmup', type=float, default=0.5, help="Seconds of streaming before SIGTERM")
+    parser.add_argument('--drain-timeout', type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    return harness.emit(asyncio.run(simulate(args)), args.output)
+
+if __name__ == "__main__":
+    harness.run(main)
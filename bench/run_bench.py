@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark suite
+Runs the web server, the webhook and the bot's message handlers as separate
+processes against a local Telegram stand-in and reports latency percentiles,
+throughput, and the CPU and RSS of those processes per scenario as JSON
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+
+from bench import harness
+from bench.fake_telegram import FakeTelegram, file_bytes
+from file_descriptor import url_signature
+
+BOT_TOKEN = "123456:BENCH"
+URL_SECRET = "bench-secret"
+CHAT_ID = 424242
+
+SCENARIOS = ("intake", "watch", "range", "flood", "bot", "batch")
+# Process whose resource use a scenario measures
+SCENARIO_PROCESS = {
+    "intake": "webhook", "flood": "webhook", "watch": "server", "range": "server", "bot": "bot", "batch": "bot",
+}
+# How often process RSS is sampled while a scenario runs
+RSS_SAMPLE_INTERVAL = 0.05
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def free_port() -> int:
+    """Reserve an ephemeral local port"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+def rss_mb(pid: int) -> Optional[float]:
+    """Current resident set size of a process in MiB, where /proc is available"""
+    try:
+        with open(f'/proc/{pid}/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except OSError:
+        return None
+    return pages * PAGE_SIZE / (1024 * 1024)
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """User plus system CPU time of a process, where /proc is available"""
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            # The command name may contain spaces, so split after its closing paren
+            fields = stat.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+def file_update(update_id: int) -> Dict:
+    """A Telegram update carrying one media message"""
+    kind = ("document", "video", "audio", "photo", "animation")[update_id % 5]
+    media = {"file_id": f"F{update_id}", "file_unique_id": f"U{update_id}", "file_size": 1024 * update_id}
+    message = {"message_id": update_id, "date": 0, "chat": {"id": CHAT_ID, "type": "private"}}
+    if kind == "photo":
+        message["photo"] = [dict(media, file_id=f"{media['file_id']}s", file_size=100), media]
+    else:
+        message[kind] = dict(media, file_name=f"{kind}_{update_id}.bin", mime_type="application/octet-stream")
+    return {"update_id": update_id, "message": message}
+
+def noise_update(update_id: int) -> Dict:
+    """An update the webhook does not act on"""
+    chat = {"id": CHAT_ID, "type": "private"}
+    kind = update_id % 4
+    if kind == 0:
+        return {"update_id": update_id, "edited_message": {"message_id": 1, "date": 0, "chat": chat, "text": "edit"}}
+    if kind == 1:
+        return {"update_id": update_id, "callback_query": {"id": str(update_id), "data": "x", "chat_instance": "1"}}
+    if kind == 2:
+        return {"update_id": update_id, "channel_post": {"message_id": 1, "date": 0, "chat": chat, "text": "post"}}
+    return {"update_id": update_id, "message": {"message_id": 1, "date": 0, "chat": chat, "text": "hello"}}
+
+def wait_listening(port: int, proc: subprocess.Popen, timeout: float = 15.0):
+    """Block until a child process accepts connections on port"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Process exited with {proc.returncode} before listening on {port}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on {port} after {timeout}s")
+
+class BenchEnvironment:
+    """Fake Telegram in-process; web server, webhook and bot as child processes
+
+    The code under test runs in its own processes so CPU and RSS are measured
+    for it alone, and it does not share a GIL with the load generator.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.fake = FakeTelegram(args.file_size, args.latency_ms, args.jitter_ms, args.error_rate, args.seed)
+        self.server_url = ""
+        self.webhook_url = ""
+        self.bot_url = ""
+        self.processes: Dict[str, subprocess.Popen] = {}
+        # Holds the bot's link index, so runs never share one
+        self.workdir = tempfile.mkdtemp(prefix='bench-')
+
+    def start(self):
+        fake_url = self.fake.start()
+        env = dict(
+            os.environ,
+            TELEGRAM_API_URL=fake_url,
+            TELEGRAM_BOT_TOKEN=BOT_TOKEN,
+            URL_SECRET=URL_SECRET,
+            VERCEL_URL='http://bench.invalid',
+            LOG_LEVEL='WARNING',
+        )
+        server_port, webhook_port, bot_port = free_port(), free_port(), free_port()
+        bot_env = dict(
+            env,
+            TELEGRAM_API_ID='1',
+            TELEGRAM_API_HASH='bench',
+            BASE_URL=f"http://127.0.0.1:{server_port}",
+            LINK_INDEX_PATH=os.path.join(self.workdir, 'link_index.db'),
+        )
+        commands = {
+            "server": ([sys.executable, 'server.py'], dict(env, PORT=str(server_port)), server_port),
+            "webhook": ([sys.executable, '-m', 'bench.webhook_host', '--port', str(webhook_port)], env, webhook_port),
+            "bot": ([sys.executable, '-m', 'bench.bot_host', '--port', str(bot_port)], bot_env, bot_port),
+        }
+        for name, (command, proc_env, port) in commands.items():
+            self.processes[name] = subprocess.Popen(
+                command, cwd=harness.ROOT, env=proc_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        for name, (_, _, port) in commands.items():
+            wait_listening(port, self.processes[name])
+        self.server_url = f"http://127.0.0.1:{server_port}"
+        self.webhook_url = f"http://127.0.0.1:{webhook_port}/webhook"
+        self.bot_url = f"http://127.0.0.1:{bot_port}"
+
+    def stop(self):
+        for proc in self.processes.values():
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in self.processes.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        self.fake.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def pids(self) -> Dict[str, int]:
+        return {name: proc.pid for name, proc in self.processes.items()}
+
+    def watch_url(self, file_id: str, filename: str) -> str:
+        timestamp = str(int(time.time()))
+        url_hash = url_signature(file_id, timestamp, URL_SECRET)
+        return f"{self.server_url}/watch/{file_id}/{filename}?hash={url_hash}&t={timestamp}"
+
+Request = Callable[[aiohttp.ClientSession, int], "asyncio.Future"]
+
+async def sample_rss(pids: Dict[str, int], peaks: Dict[str, float], stop: asyncio.Event):
+    """Track the peak RSS of each process until stop is set"""
+    while True:
+        for name, pid in pids.items():
+            current = rss_mb(pid)
+            if current is not None:
+                peaks[name] = max(peaks.get(name, 0.0), current)
+        if stop.is_set():
+            return
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+def process_usage(cpu_start: Optional[float], cpu_end: Optional[float], elapsed: float,
+                  pid: int, peak_rss: Optional[float]) -> Dict:
+    if cpu_start is None or cpu_end is None:
+        return {"cpu_s": None, "cpu_utilization": None, "rss_mb": None, "peak_rss_mb": None}
+    cpu_used = cpu_end - cpu_start
+    return {
+        "cpu_s": round(cpu_used, 4),
+        "cpu_utilization": round(cpu_used / elapsed, 3) if elapsed else 0.0,
+        "rss_mb": round(rss_mb(pid) or 0.0, 2),
+        "peak_rss_mb": round(peak_rss or 0.0, 2),
+    }
+
+async def run_load(request: Request, total: int, concurrency: int, pids: Dict[str, int]) -> Dict:
+    """Issue `total` requests with bounded concurrency and collect metrics
+
+    CPU and RSS are read from /proc for the processes in pids.
+    """
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+    peaks: Dict[str, float] = {}
+    stop_sampling = asyncio.Event()
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                ok = await request(session, i)
+            except Exception:
+                ok = False
+            latencies.append((time.perf_counter() - started) * 1000)
+            if not ok:
+                errors += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        sampler = asyncio.create_task(sample_rss(pids, peaks, stop_sampling))
+        cpu_start = {name: cpu_seconds(pid) for name, pid in pids.items()}
+        wall_start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - wall_start
+        cpu_end = {name: cpu_seconds(pid) for name, pid in pids.items()}
+        stop_sampling.set()
+        await sampler
+
+    return {
+        "requests": total,
+        "errors": errors,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round((total - errors) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(max(latencies), 3) if latencies else 0.0,
+        },
+        "processes": {
+            name: process_usage(cpu_start[name], cpu_end[name], elapsed, pid, peaks.get(name))
+            for name, pid in pids.items()
+        },
+    }
+
+def build_scenario(name: str, env: BenchEnvironment, args: argparse.Namespace) -> Request:
+    """Return the per-request coroutine for a scenario"""
+    rng = random.Random(args.seed)
+
+    if name == "intake":
+        async def request(session, i):
+            async with session.post(env.webhook_url, json=file_update(i + 1)) as resp:
+                await resp.read()
+                return resp.status == 200
+        return request
+
+    if name == "flood":
+        async def request(session, i):
+            update = file_update(i + 1) if i % 10 < 3 else noise_update(i + 1)
+            async with session.post(env.webhook_url, json=update) as resp:
+                await resp.read()
+                return resp.status == 200
+        return request
+
+    if name == "watch":
+        extensions = ("mp4", "mp3", "jpg")
+        async def request(session, i):
+            url = env.watch_url(f"F{i}", f"file_{i}.{extensions[i % 3]}")
+            async with session.get(url) as resp:
+                await resp.read()
+                return resp.status == 200
+        return request
+
+    if name == "range":
+        async def request(session, i):
+            start = rng.randrange(0, args.file_size - args.range_size)
+            end = start + args.range_size - 1
+            url = env.watch_url(f"F{i}", f"file_{i}.bin")
+            async with session.get(url, headers={'Range': f"bytes={start}-{end}"}) as resp:
+                body = await resp.read()
+                # Seeks must land on exactly the requested bytes
+                return resp.status == 206 and body == file_bytes(start, end)
+        return request
+
+    if name == "bot":
+        # The second half repeats the first, so those uploads are answered from the link index
+        distinct = max(args.requests // 2, 1)
+        async def request(session, i):
+            async with session.post(f"{env.bot_url}/message", json=file_update(i % distinct + 1)) as resp:
+                replies = (await resp.json())["replies"]
+                return resp.status == 200 and replies[-1].lstrip().startswith("✅")
+        return request
+
+    if name == "batch":
+        async def request(session, i):
+            # Fresh files, so every batch resolves its links through getFile
+            first = args.requests + i * args.batch_size + 1
+            body = {"chat_id": CHAT_ID + i, "updates": [file_update(first + j) for j in range(args.batch_size)]}
+            async with session.post(f"{env.bot_url}/batch", json=body) as resp:
+                replies = (await resp.json())["replies"]
+                return resp.status == 200 and any(f"{args.batch_size} of {args.batch_size}" in r for r in replies)
+        return request
+
+    raise ValueError(f"Unknown scenario: {name}")
+
+def scenario_requests(name: str, args: argparse.Namespace) -> int:
+    """Requests to issue for a scenario; a /batch request carries batch_size files"""
+    if name == "batch":
+        return max(args.requests // args.batch_size, 1)
+    return args.requests
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=harness.ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def compare(report: Dict, baseline: Dict) -> Dict:
+    """Relative change of key metrics against a previous report"""
+    changes = {}
+    for name, result in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        delta = {}
+        for pct in ("p50", "p95", "p99"):
+            old = base["latency_ms"][pct]
+            delta[f"{pct}_pct"] = round((result["latency_ms"][pct] - old) / old * 100, 1) if old else None
+        old_rps = base["throughput_rps"]
+        delta["throughput_pct"] = round((result["throughput_rps"] - old_rps) / old_rps * 100, 1) if old_rps else None
+        changes[name] = delta
+    return changes
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = harness.parser("Benchmark bot, server and webhook against a local Telegram stand-in")
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help="Scenario to run (repeatable, default all)")
+    parser.add_argument('--requests', type=int, default=500, help="Requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--file-size', type=int, default=16 * 1024 * 1024)
+    parser.add_argument('--range-size', type=int, default=256 * 1024, help="Bytes per range request")
+    parser.add_argument('--batch-size', type=int, default=20, help="Files per /batch request")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Injected upstream latency")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Extra random upstream latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of upstream calls that fail")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help="Previous JSON report to compare against")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    args = parse_args(argv)
+    env = BenchEnvironment(args)
+    env.start()
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "timestamp": int(time.time()),
+        "params": {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        "scenarios": {},
+    }
+    try:
+        for name in args.scenario or SCENARIOS:
+            request = build_scenario(name, env, args)
+            result = asyncio.run(run_load(request, scenario_requests(name, args), args.concurrency, env.pids()))
+            # Top-level resource figures are for the process the scenario exercises
+            result.update(result["processes"][SCENARIO_PROCESS[name]])
+            result["upstream_calls"] = dict(env.fake.requests)
+            env.fake.requests.clear()
+            report["scenarios"][name] = result
+    finally:
+        env.stop()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["compare"] = compare(report, json.load(f))
+
+    return harness.emit(report, args.output)
+
+if __name__ == "__main__":
+    harness.run(main)
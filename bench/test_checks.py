@@ -0,0 +1,18 @@
+"""
+pytest entry points for the bench scripts that check behaviour
+Each script's report carries named checks; a test fails with the ones that did not pass
+"""
+
+from bench import cache_proxy, resilience_check, rolling_restart
+
+def failed_checks(report):
+    return [name for name, ok in report["checks"].items() if not ok]
+
+def test_rolling_restart_drains_and_resumes():
+    assert failed_checks(rolling_restart.main([])) == []
+
+def test_http_caching():
+    assert failed_checks(cache_proxy.main([])) == []
+
+def test_resilience():
+    assert failed_checks(resilience_check.main([])) == []
@@ -0,0 +1,99 @@
+"""
+Tests for the file_unique_id link index
+TTL expiry, LRU eviction, queued writes, compaction and reuse stats
+"""
+
+import asyncio
+import time
+
+from file_descriptor import FileDescriptor
+from link_index import LinkIndex, LinkRecord
+
+def record(n: int, age: int = 0) -> LinkRecord:
+    descriptor = FileDescriptor('document', f"F{n}", f"U{n}", f"file_{n}.bin", 1024 * n, 'application/octet-stream')
+    return LinkRecord(f"U{n}", descriptor, f"documents/file_{n}.bin", int(time.time()) - age)
+
+def open_index(tmp_path, **kwargs) -> LinkIndex:
+    return LinkIndex(str(tmp_path / "links.db"), **kwargs)
+
+def test_get_counts_reuses(tmp_path):
+    index = open_index(tmp_path, ttl=60)
+    index.put(record(1))
+    assert index.get("U1").hits == 1
+    assert index.get("U1").hits == 2
+    assert index.get("U2") is None
+    index.close()
+
+def test_expired_links_are_not_reused(tmp_path):
+    index = open_index(tmp_path, ttl=60)
+    index.put(record(1, age=120))
+    index.put(record(2))
+    assert index.get("U1") is None
+    assert index.get("U2") is not None
+    index.close()
+
+def test_lru_evicts_oldest_but_keeps_links_reachable(tmp_path):
+    index = open_index(tmp_path, ttl=60, cache_size=2)
+    for n in (1, 2, 3):
+        index.put(record(n))
+    assert list(index.cache) == ["U2", "U3"]
+    # Evicted before a flush, then after one
+    assert index.get("U1").file_path == "documents/file_1.bin"
+    asyncio.run(index.flush())
+    index.cache.clear()
+    assert index.get("U2").descriptor == record(2).descriptor
+    assert len(index.cache) <= 2
+    index.close()
+
+def test_put_is_written_by_flush(tmp_path):
+    index = open_index(tmp_path, ttl=60)
+    index.put(record(1))
+    assert index.db.execute("SELECT COUNT(*) FROM file_links").fetchone() == (0,)
+    asyncio.run(index.flush())
+    assert index.db.execute("SELECT COUNT(*) FROM file_links").fetchone() == (1,)
+    assert not index.pending_links
+    index.close()
+
+def test_close_persists_queued_writes(tmp_path):
+    index = open_index(tmp_path, ttl=60)
+    index.put(record(1))
+    index.get("U1")
+    index.close()
+
+    reopened = open_index(tmp_path, ttl=60)
+    assert reopened.get("U1").hits == 2
+    reopened.close()
+
+def test_compaction_drops_expired_links_and_keeps_stats(tmp_path):
+    index = open_index(tmp_path, ttl=60)
+    index.put(record(1, age=30))
+    index.put(record(2))
+    index.get("U1")
+    index.get("U1")
+    index.get("U2")
+    asyncio.run(index.flush())
+
+    # U1 expires before the next compaction
+    index.ttl = 10
+    removed, stats = asyncio.run(index.compact())
+    assert removed == 1
+    assert "U1" not in index.cache
+    assert stats == {"entries": 1, "reused_files": 2, "total_reuses": 3}
+    index.close()
+
+def test_reuse_stats_include_queued_writes(tmp_path):
+    index = open_index(tmp_path, ttl=60)
+    index.put(record(1))
+    index.put(record(2))
+    index.get("U1")
+    assert asyncio.run(index.reuse_stats()) == {"entries": 2, "reused_files": 1, "total_reuses": 1}
+    index.close()
+
+def test_in_memory_index_compacts_on_the_main_connection():
+    index = LinkIndex(":memory:", ttl=60)
+    index.put(record(1))
+    index.get("U1")
+    removed, stats = asyncio.run(index.compact())
+    assert removed == 0
+    assert stats == {"entries": 1, "reused_files": 1, "total_reuses": 1}
+    index.close()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Local host for the Vercel webhook handler
+Serves api/webhook.py with the stdlib threading HTTP server, so benchmarks
+can run it as a separate process (python -m bench.webhook_host)
+"""
+
+import argparse
+from http.server import ThreadingHTTPServer
+
+from api.webhook import handler
+
+class WebhookServer(ThreadingHTTPServer):
+    """Threading server with a listen backlog sized for load tests"""
+    # The default backlog of 5 overflows under load and adds 1s SYN retries
+    request_queue_size = 1024
+    daemon_threads = True
+
+class QuietHandler(handler):
+    def log_message(self, format, *args):
+        pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the webhook handler locally")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    args = parser.parse_args(argv)
+
+    server = WebhookServer((args.host, args.port), QuietHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
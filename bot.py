@@ -5,25 +5,62 @@ Converts Telegram files to streamable/downloadable links without storing files
 """
 
 import os
+import io
 import asyncio
 import logging
-from typing import Optional
+import functools
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import quote
-import hashlib
-import hmac
 import time
-from pyrogram import filters
+import aiohttp
+from pyrogram import enums, filters
 from pyrogram.client import Client
 from pyrogram.types import Message
 import aiofiles
+from file_descriptor import FileDescriptor
+from link_index import LinkIndex, LinkRecord
+from log_config import request_id, setup_logging
+from resilience import Deadline, Resilience, get_file, upstream_key
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Bulk link generation limits
+BATCH_PROGRESS_INTERVAL = 2.0  # seconds between progress message edits
+BATCH_FETCH_CHUNK = 200  # max message IDs per get_messages call
+BATCH_PAGE_CHARS = 3500  # stay well below Telegram's 4096 char message limit
+BATCH_MAX_PAGES = 3  # longer link lists are exported as a text file
+
+# How often expired entries are compacted out of the link index
+LINK_INDEX_COMPACT_INTERVAL = 6 * 3600
+# How often idle /batch sessions are expired and link reuse counts written
+HOUSEKEEPING_INTERVAL = 60
+
+def with_request_id(handler):
+    """Tag logs from a message handler with chat:message, resetting it afterwards
+
+    Pyrogram runs handlers on long-lived worker tasks, so an id left set would
+    leak into whatever that worker handles next.
+    """
+    @functools.wraps(handler)
+    async def wrapper(client, message: Message):
+        token = request_id.set(f"{message.chat.id}:{message.id}")
+        try:
+            return await handler(client, message)
+        finally:
+            request_id.reset(token)
+    return wrapper
+
+class BatchSession:
+    """Files collected in one chat between /batch and /done"""
+    __slots__ = ('descriptors', 'last_active', 'limit_notified')
+    
+    def __init__(self):
+        self.descriptors: List[Optional[FileDescriptor]] = []
+        self.last_active = time.monotonic()
+        self.limit_notified = False
+
 class TelegramFileLinkBot:
     def __init__(self):
         self.api_id = int(os.getenv('TELEGRAM_API_ID', '0'))
@@ -31,6 +68,24 @@ class TelegramFileLinkBot:
         self.bot_token = os.getenv('TELEGRAM_BOT_TOKEN', '')
         self.url_secret = os.getenv('URL_SECRET', 'default-secret-key-change-me')
         self.base_url = os.getenv('BASE_URL', 'https://your-bot-name.koyeb.app')
+        self.api_url = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+        self.batch_max_files = int(os.getenv('BATCH_MAX_FILES', '500'))
+        self.batch_concurrency = int(os.getenv('BATCH_CONCURRENCY', '8'))
+        # Seconds a /batch session may sit idle before it is dropped
+        self.batch_session_ttl = int(os.getenv('BATCH_SESSION_TTL', '1800'))
+        # Seconds a single file may take to resolve, across all retries
+        self.request_deadline = float(os.getenv('REQUEST_DEADLINE', '15'))
+        
+        # Pending /batch sessions by chat_id
+        self.batch_sessions: Dict[int, BatchSession] = {}
+        # Shared Bot API session, created lazily inside the running loop
+        self.http_session: Optional[aiohttp.ClientSession] = None
+        # Retries, hedging and per-DC circuit breakers for Bot API calls
+        self.resilience = Resilience()
+        # Previously issued links, keyed by file_unique_id
+        self.link_index = LinkIndex()
+        # Set by stop() to end run() once the web server has drained
+        self.stop_event: Optional[asyncio.Event] = None
         
         # Validate required credentials
         if not self.api_id or self.api_id == 0:
@@ -40,7 +95,7 @@ class TelegramFileLinkBot:
         if not self.bot_token:
             raise ValueError("TELEGRAM_BOT_TOKEN is required")
         
-        logger.info(f"Bot configured for URL: {self.base_url}")
+        logger.info("Bot configured for URL: %s", self.base_url)
         
         # Initialize Pyrogram client
         self.app = Client(
@@ -58,6 +113,7 @@ class TelegramFileLinkBot:
         """Setup message handlers"""
         
         @self.app.on_message(filters.command("start"))
+        @with_request_id
         async def start_command(client, message: Message):
             welcome_text = """
 🤖 **Welcome to File Link Generator Bot!**
@@ -76,68 +132,71 @@ Send me any file and I'll generate streaming and download links for you.
 • No file storage - uses Telegram's servers
 • Fast access from any browser
 
+**Bulk links:**
+• `/batch` then forward your files, finish with `/done`
+• `/batch <channel> <first_id> <last_id>` for a message range
+
 Just drop your file and I'll handle the rest! 📁✨
             """
             await message.reply_text(welcome_text)
 
+        @self.app.on_message(filters.command("batch"))
+        @with_request_id
+        async def batch_command(client, message: Message):
+            try:
+                await self.start_batch(message)
+            except Exception as e:
+                logger.error("Error starting batch: %s", e)
+                await message.reply_text("❌ Sorry, the batch could not be processed. Please try again.")
+
+        @self.app.on_message(filters.command("done"))
+        @with_request_id
+        async def done_command(client, message: Message):
+            try:
+                await self.finish_batch(message)
+            except Exception as e:
+                logger.error("Error finishing batch: %s", e)
+                await message.reply_text("❌ Sorry, the batch could not be processed. Please try again.")
+
         @self.app.on_message(filters.document | filters.video | filters.audio | filters.photo | filters.animation)
+        @with_request_id
         async def handle_file(client, message: Message):
+            # Files sent during a /batch session are collected, not answered
+            session = self.batch_sessions.get(message.chat.id)
+            if session is not None:
+                await self.collect_batch_file(session, message)
+                return
             try:
                 await self.process_file_message(message)
             except Exception as e:
-                logger.error(f"Error processing file: {e}")
+                logger.error("Error processing file: %s", e)
                 await message.reply_text("❌ Sorry, there was an error processing your file. Please try again.")
 
     async def process_file_message(self, message: Message):
         """Process incoming file message and generate links"""
         
         # Determine file type and get file info
-        file_info = None
-        file_name = "file"
-        file_size = 0
-        
-        if message.document:
-            file_info = message.document
-            file_name = file_info.file_name or f"document_{file_info.file_id}.{file_info.mime_type.split('/')[-1] if file_info.mime_type else 'bin'}"
-            file_size = file_info.file_size
-        elif message.video:
-            file_info = message.video
-            file_name = file_info.file_name or f"video_{file_info.file_id}.mp4"
-            file_size = file_info.file_size
-        elif message.audio:
-            file_info = message.audio
-            file_name = file_info.file_name or f"audio_{file_info.file_id}.mp3"
-            file_size = file_info.file_size
-        elif message.photo:
-            file_info = message.photo
-            file_name = f"photo_{file_info.file_id}.jpg"
-            file_size = file_info.file_size
-        elif message.animation:
-            file_info = message.animation
-            file_name = file_info.file_name or f"animation_{file_info.file_id}.gif"
-            file_size = file_info.file_size
-        
-        if not file_info:
+        descriptor = FileDescriptor.from_message(message)
+        
+        if not descriptor:
             await message.reply_text("❌ Unsupported file type.")
             return
         
-        # Get file path from Telegram
+        # Get links, from the index for repeat uploads or from Telegram
         try:
-            file_path = await self.get_file_path(file_info.file_id)
-            if not file_path:
+            links = await self.resolve_links(descriptor, Deadline(self.request_deadline))
+            if not links:
                 await message.reply_text("❌ Could not get file information from Telegram.")
                 return
         except Exception as e:
-            logger.error(f"Error getting file path: {e}")
+            logger.error("Error getting file path: %s", e)
             await message.reply_text("❌ Could not access file. Please try again.")
             return
-        
-        # Generate secure URLs
-        stream_url = self.generate_stream_url(file_info.file_id, file_name, file_path)
-        download_url = self.generate_download_url(file_path)
+        stream_url, download_url, descriptor = links
+        file_name = descriptor.file_name
         
         # Format file size
-        size_str = self.format_file_size(file_size)
+        size_str = descriptor.size_label
         
         # Create response message
         response_text = f"""
@@ -162,72 +221,257 @@ Just drop your file and I'll handle the rest! 📁✨
         """
         
         await message.reply_text(response_text)
+        logger.info("Issued links for %s (%s)", descriptor.file_unique_id, size_str, extra={'sampled': True})
 
-    async def get_file_path(self, file_id: str) -> Optional[str]:
+    async def resolve_links(self, descriptor: FileDescriptor, deadline: Deadline) -> Optional[Tuple[str, str, FileDescriptor]]:
+        """Return (stream_url, download_url, descriptor), reusing indexed links"""
+        record = self.link_index.get(descriptor.file_unique_id)
+        if record is None:
+            file_path = await self.get_file_path(descriptor.file_id, deadline)
+            if not file_path:
+                return None
+            record = LinkRecord(
+                file_unique_id=descriptor.file_unique_id,
+                descriptor=descriptor,
+                file_path=file_path,
+                issued_at=int(time.time())
+            )
+            self.link_index.put(record)
+        
+        # Rebuilding from the stored timestamp reproduces the original link exactly
+        stream_url = self.generate_stream_url(record.descriptor, record.issued_at)
+        download_url = self.generate_download_url(record.file_path)
+        return stream_url, download_url, record.descriptor
+
+    async def get_http_session(self) -> aiohttp.ClientSession:
+        """Return the shared Bot API session, creating it on first use"""
+        if self.http_session is None or self.http_session.closed:
+            self.http_session = aiohttp.ClientSession()
+        return self.http_session
+
+    async def get_file_path(self, file_id: str, deadline: Optional[Deadline] = None) -> Optional[str]:
         """Get file path from Telegram using file_id"""
         try:
-            # Download the file to get file path information
-            file_obj = await self.app.download_media(file_id, in_memory=True)
             # For streaming, we need to use Bot API to get file path
-            import aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"https://api.telegram.org/bot{self.bot_token}/getFile?file_id={file_id}") as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        if data.get('ok') and 'result' in data:
-                            return data['result'].get('file_path')
-            return None
+            session = await self.get_http_session()
+            result = await self.resilience.call(
+                upstream_key(file_id),
+                lambda: get_file(session, self.api_url, self.bot_token, file_id),
+                deadline or Deadline(self.request_deadline),
+                idempotent=True
+            )
+            return result.get('file_path')
         except Exception as e:
-            logger.error(f"Error getting file path for {file_id}: {e}")
+            logger.error("Error getting file path for %s: %s", file_id, e)
+            return None
+
+    async def collect_batch_file(self, session: BatchSession, message: Message):
+        """Add a forwarded file to a /batch session, telling the user once the limit is hit"""
+        session.last_active = time.monotonic()
+        if len(session.descriptors) < self.batch_max_files:
+            # Only the descriptor is kept, not the whole message
+            session.descriptors.append(FileDescriptor.from_message(message))
+            return
+        if not session.limit_notified:
+            session.limit_notified = True
+            await message.reply_text(
+                f"⚠️ Batch limit of {self.batch_max_files} files reached. "
+                "Further files are ignored; send /done to get your links."
+            )
+
+    async def expire_batch_sessions(self):
+        """Drop /batch sessions that have been idle longer than the session TTL"""
+        cutoff = time.monotonic() - self.batch_session_ttl
+        for chat_id in [c for c, s in self.batch_sessions.items() if s.last_active < cutoff]:
+            session = self.batch_sessions.pop(chat_id)
+            logger.info("Expired idle batch in %s (%d files)", chat_id, len(session.descriptors))
+            try:
+                await self.app.send_message(chat_id, "⌛ Your batch expired after inactivity. Send /batch to start again.")
+            except Exception as e:
+                logger.debug("Batch expiry notice skipped: %s", e)
+
+    async def start_batch(self, message: Message):
+        """Handle /batch: open a forwarding session or resolve a message range"""
+        args = message.command[1:]
+        
+        if not args:
+            self.batch_sessions[message.chat.id] = BatchSession()
+            await message.reply_text(
+                f"📦 **Batch mode on.** Forward up to {self.batch_max_files} files, then send /done."
+            )
+            return
+        
+        if len(args) != 3:
+            await message.reply_text("❌ Usage: `/batch <channel> <first_id> <last_id>`")
+            return
+        
+        chat_ref = args[0]
+        try:
+            first_id, last_id = int(args[1]), int(args[2])
+        except ValueError:
+            await message.reply_text("❌ Message IDs must be numbers.")
+            return
+        if first_id > last_id:
+            first_id, last_id = last_id, first_id
+        if last_id - first_id + 1 > self.batch_max_files:
+            await message.reply_text(f"❌ A batch is limited to {self.batch_max_files} messages.")
+            return
+        
+        chat_id = int(chat_ref) if chat_ref.lstrip('-').isdigit() else chat_ref
+        status = await message.reply_text("⏳ Fetching messages...")
+        
+        # Fetch the range in chunks; empty or deleted messages are skipped
+        descriptors: List[Optional[FileDescriptor]] = []
+        ids = list(range(first_id, last_id + 1))
+        for i in range(0, len(ids), BATCH_FETCH_CHUNK):
+            fetched = await self.app.get_messages(chat_id, message_ids=ids[i:i + BATCH_FETCH_CHUNK])
+            descriptors.extend(FileDescriptor.from_message(m) for m in fetched if m and not m.empty)
+        
+        await self.send_batch_links(message, status, descriptors)
+
+    async def finish_batch(self, message: Message):
+        """Handle /done: resolve every file collected since /batch"""
+        session = self.batch_sessions.pop(message.chat.id, None)
+        if session is None:
+            await message.reply_text("❌ No batch in progress. Send /batch first.")
+            return
+        
+        status = await message.reply_text("⏳ Resolving files...")
+        await self.send_batch_links(message, status, session.descriptors)
+
+    async def resolve_batch(self, descriptors: List[Optional[FileDescriptor]], status: Message) -> List[Optional[str]]:
+        """Resolve links for many files concurrently, editing progress into one message"""
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        total = len(descriptors)
+        done = 0
+        last_edit = time.monotonic()
+        
+        async def resolve(descriptor: Optional[FileDescriptor]) -> Optional[str]:
+            nonlocal done, last_edit
+            async with semaphore:
+                entry = await self.build_link_entry(descriptor)
+            done += 1
+            now = time.monotonic()
+            if done < total and now - last_edit >= BATCH_PROGRESS_INTERVAL:
+                last_edit = now
+                try:
+                    await status.edit_text(f"⏳ Resolving files... {done}/{total}")
+                except Exception as e:
+                    logger.debug("Progress edit skipped: %s", e)
+            return entry
+        
+        return await asyncio.gather(*(resolve(d) for d in descriptors))
+
+    async def build_link_entry(self, descriptor: Optional[FileDescriptor]) -> Optional[str]:
+        """Build one link list line for a file, or None if the message had no usable file"""
+        if not descriptor:
             return None
+        
+        links = await self.resolve_links(descriptor, Deadline(self.request_deadline))
+        if not links:
+            return f"⚠️ {descriptor.file_name} - could not access file"
+        
+        stream_url, download_url, descriptor = links
+        return f"📁 {descriptor.file_name} ({descriptor.size_label})\n🔗 {stream_url}\n⬇️ {download_url}"
 
-    def generate_stream_url(self, file_id: str, file_name: str, file_path: str) -> str:
+    async def send_batch_links(self, message: Message, status: Message, descriptors: List[Optional[FileDescriptor]]):
+        """Resolve a batch and deliver the link list as pages or an exported file"""
+        if not descriptors:
+            await status.edit_text("❌ No files found in this batch.")
+            return
+        
+        entries = [e for e in await self.resolve_batch(descriptors, status) if e]
+        if not entries:
+            await status.edit_text("❌ No supported files found in this batch.")
+            return
+        
+        pages = self.paginate_entries(entries)
+        summary = f"✅ **Batch complete:** {len(entries)} of {len(descriptors)} messages linked."
+        
+        if len(pages) > BATCH_MAX_PAGES:
+            export = io.BytesIO("\n\n".join(entries).encode('utf-8'))
+            export.name = "links.txt"
+            await status.edit_text(summary)
+            await message.reply_document(export, caption="📋 Full link list")
+            return
+        
+        await status.edit_text(summary)
+        for page in pages:
+            await message.reply_text(page, disable_web_page_preview=True, parse_mode=enums.ParseMode.DISABLED)
+
+    def paginate_entries(self, entries: List[str]) -> List[str]:
+        """Split link entries into pages that fit in a Telegram message"""
+        pages: List[str] = []
+        current = ""
+        for entry in entries:
+            if current and len(current) + len(entry) + 2 > BATCH_PAGE_CHARS:
+                pages.append(current)
+                current = ""
+            current = f"{current}\n\n{entry}" if current else entry
+        if current:
+            pages.append(current)
+        return pages
+
+    def generate_stream_url(self, descriptor: FileDescriptor, issued_at: Optional[int] = None) -> str:
         """Generate streaming URL for the web player"""
         # Create hash for security
-        timestamp = str(int(time.time()))
-        hash_string = f"{file_id}:{file_path}:{timestamp}:{self.url_secret}"
-        url_hash = hmac.new(
-            self.url_secret.encode(),
-            hash_string.encode(),
-            hashlib.sha256
-        ).hexdigest()[:16]
+        timestamp = str(issued_at if issued_at is not None else int(time.time()))
+        url_hash = descriptor.signature(timestamp, self.url_secret)
         
         # URL encode the filename
-        encoded_filename = quote(file_name)
+        encoded_filename = quote(descriptor.file_name)
         
-        return f"{self.base_url}/watch/{file_id}/{encoded_filename}?hash={url_hash}&t={timestamp}"
+        return f"{self.base_url}/watch/{descriptor.file_id}/{encoded_filename}?hash={url_hash}&t={timestamp}"
 
     def generate_download_url(self, file_path: str) -> str:
         """Generate direct download URL from Telegram CDN"""
-        return f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"
-
-    def format_file_size(self, size_bytes: int) -> str:
-        """Format file size in human readable format"""
-        if size_bytes == 0:
-            return "0 B"
-        size_names = ["B", "KB", "MB", "GB"]
-        i = 0
-        size_float = float(size_bytes)
-        while size_float >= 1024 and i < len(size_names) - 1:
-            size_float /= 1024.0
-            i += 1
-        return f"{size_float:.1f} {size_names[i]}"
+        return f"{self.api_url}/file/bot{self.bot_token}/{file_path}"
+
+    async def housekeeping(self):
+        """Periodically expire idle /batch sessions and maintain the link index"""
+        last_compact = time.monotonic()
+        while True:
+            await asyncio.sleep(HOUSEKEEPING_INTERVAL)
+            try:
+                await self.expire_batch_sessions()
+            except Exception as e:
+                logger.error("Error expiring batch sessions: %s", e)
+            try:
+                if time.monotonic() - last_compact < LINK_INDEX_COMPACT_INTERVAL:
+                    await self.link_index.flush()
+                    continue
+                last_compact = time.monotonic()
+                removed, stats = await self.link_index.compact()
+                logger.info("Link index compacted: %d expired, stats %s", removed, stats)
+            except Exception as e:
+                logger.error("Error compacting link index: %s", e)
 
     async def run(self):
         """Start the bot"""
         logger.info("Starting Telegram File Link Bot...")
         await self.app.start()
         logger.info("Bot started successfully!")
+        housekeeper = asyncio.create_task(self.housekeeping())
         # Keep the bot running
         try:
-            import signal
-            import asyncio
-            await asyncio.Event().wait()
+            if self.stop_event is None:
+                self.stop_event = asyncio.Event()
+            await self.stop_event.wait()
         except KeyboardInterrupt:
             logger.info("Bot stopped by user")
         finally:
+            housekeeper.cancel()
+            self.link_index.close()
+            if self.http_session and not self.http_session.closed:
+                await self.http_session.close()
             await self.app.stop()
 
+    def stop(self):
+        """Ask run() to shut the bot down"""
+        if self.stop_event is None:
+            self.stop_event = asyncio.Event()
+        self.stop_event.set()
+
 # Bot instance
 bot = TelegramFileLinkBot()
 
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Compact file descriptor shared by the bot, web server and webhook
+Built once per message and reused for signing, caching, rendering and streaming
+"""
+
+import base64
+import hashlib
+import hmac
+import mimetypes
+import struct
+from typing import Any, Dict, Optional
+
+MEDIA_KINDS = ('document', 'video', 'audio', 'photo', 'animation')
+
+VIDEO_EXTENSIONS = frozenset(('mp4', 'webm', 'mov', 'avi', 'mkv'))
+AUDIO_EXTENSIONS = frozenset(('mp3', 'wav', 'ogg', 'aac', 'flac'))
+IMAGE_EXTENSIONS = frozenset(('jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp'))
+
+# Binary layout: version, kind index, file size, then length-prefixed UTF-8
+# file_id, file_unique_id, file_name and mime_type
+SERIAL_VERSION = 1
+HEADER = struct.Struct('>BBQ')
+LENGTH = struct.Struct('>H')
+
+def format_file_size(size_bytes: int) -> str:
+    """Format file size in human readable format"""
+    if size_bytes == 0:
+        return "0 B"
+    size_names = ["B", "KB", "MB", "GB"]
+    i = 0
+    size_float = float(size_bytes)
+    while size_float >= 1024 and i < len(size_names) - 1:
+        size_float /= 1024.0
+        i += 1
+    return f"{size_float:.1f} {size_names[i]}"
+
+def default_file_name(kind: str, file_id: str, mime_type: Optional[str] = None) -> str:
+    """Fallback name for media sent without one"""
+    if kind == 'document':
+        return f"document_{file_id}.{mime_type.split('/')[-1] if mime_type else 'bin'}"
+    if kind == 'video':
+        return f"video_{file_id}.mp4"
+    if kind == 'audio':
+        return f"audio_{file_id}.mp3"
+    if kind == 'photo':
+        return f"photo_{file_id}.jpg"
+    if kind == 'animation':
+        return f"animation_{file_id}.gif"
+    return "file"
+
+def file_dc(file_id: str) -> Optional[int]:
+    """Telegram data center a file_id points at, or None if it cannot be decoded"""
+    try:
+        raw = base64.urlsafe_b64decode(file_id + '=' * (-len(file_id) % 4))
+    except (ValueError, TypeError):
+        return None
+    # file_ids are run-length encoded: a zero byte is followed by a repeat count
+    decoded = bytearray()
+    zero = False
+    for byte in raw:
+        if zero:
+            decoded.extend(b'\x00' * byte)
+            zero = False
+        elif byte == 0:
+            zero = True
+        else:
+            decoded.append(byte)
+    if len(decoded) < 8:
+        return None
+    _, dc_id = struct.unpack_from('<ii', decoded)
+    return dc_id if 0 < dc_id < 32 else None
+
+def url_signature(file_id: str, timestamp: str, secret: str) -> str:
+    """Signature carried in the hash parameter of watch links"""
+    hash_string = f"{file_id}:{timestamp}:{secret}"
+    return hmac.new(
+        secret.encode(),
+        hash_string.encode(),
+        hashlib.sha256
+    ).hexdigest()[:16]
+
+class FileDescriptor:
+    """Immutable metadata for one Telegram file"""
+
+    __slots__ = ('kind', 'file_id', 'file_unique_id', 'file_name', 'file_size', 'mime_type')
+
+    def __init__(self, kind: str, file_id: str, file_unique_id: str, file_name: str,
+                 file_size: int = 0, mime_type: str = ''):
+        setter = object.__setattr__
+        setter(self, 'kind', kind)
+        setter(self, 'file_id', file_id)
+        setter(self, 'file_unique_id', file_unique_id)
+        setter(self, 'file_name', file_name)
+        setter(self, 'file_size', file_size or 0)
+        setter(self, 'mime_type', mime_type or '')
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FileDescriptor is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("FileDescriptor is immutable")
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, FileDescriptor):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self) -> int:
+        return hash(self._fields())
+
+    def __repr__(self) -> str:
+        return (f"FileDescriptor(kind={self.kind!r}, file_id={self.file_id!r}, "
+                f"file_name={self.file_name!r}, file_size={self.file_size})")
+
+    def _fields(self):
+        return (self.kind, self.file_id, self.file_unique_id, self.file_name, self.file_size, self.mime_type)
+
+    @classmethod
+    def from_message(cls, message) -> Optional["FileDescriptor"]:
+        """Build from a Pyrogram message, or None if it carries no supported media"""
+        for kind in MEDIA_KINDS:
+            media = getattr(message, kind, None)
+            if media:
+                mime_type = getattr(media, 'mime_type', None)
+                file_name = getattr(media, 'file_name', None) or default_file_name(kind, media.file_id, mime_type)
+                return cls(kind, media.file_id, media.file_unique_id, file_name, media.file_size, mime_type)
+        return None
+
+    @classmethod
+    def from_update(cls, kind: str, media: Dict[str, Any]) -> "FileDescriptor":
+        """Build from a Bot API media object"""
+        mime_type = media.get('mime_type')
+        file_name = media.get('file_name') or default_file_name(kind, media['file_id'], mime_type)
+        return cls(kind, media['file_id'], media.get('file_unique_id', ''), file_name, media.get('file_size', 0), mime_type)
+
+    @classmethod
+    def from_link(cls, file_id: str, file_name: str, file_unique_id: str = '', file_size: int = 0) -> "FileDescriptor":
+        """Build from the file_id and name carried in a watch link, plus what getFile adds"""
+        return cls('document', file_id, file_unique_id, file_name, file_size)
+
+    @property
+    def extension(self) -> str:
+        return self.file_name.lower().split('.')[-1] if '.' in self.file_name else ''
+
+    @property
+    def player(self) -> Optional[str]:
+        """Web player for this file ('video', 'audio', 'image'), or None to download"""
+        ext = self.extension
+        if ext in VIDEO_EXTENSIONS:
+            return 'video'
+        if ext in AUDIO_EXTENSIONS:
+            return 'audio'
+        if ext in IMAGE_EXTENSIONS:
+            return 'image'
+        return None
+
+    @property
+    def content_type(self) -> str:
+        """MIME type to serve the file bytes with"""
+        return mimetypes.guess_type(self.file_name)[0] or self.mime_type or 'application/octet-stream'
+
+    @property
+    def dc_id(self) -> Optional[int]:
+        return file_dc(self.file_id)
+
+    @property
+    def size_label(self) -> str:
+        return format_file_size(self.file_size)
+
+    def signature(self, timestamp: str, secret: str) -> str:
+        return url_signature(self.file_id, timestamp, secret)
+
+    def to_bytes(self) -> bytes:
+        """Compact binary serialization"""
+        parts = [HEADER.pack(SERIAL_VERSION, MEDIA_KINDS.index(self.kind), self.file_size)]
+        for value in (self.file_id, self.file_unique_id, self.file_name, self.mime_type):
+            encoded = value.encode('utf-8')
+            parts.append(LENGTH.pack(len(encoded)))
+            parts.append(encoded)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "FileDescriptor":
+        """Inverse of to_bytes"""
+        version, kind_index, file_size = HEADER.unpack_from(data, 0)
+        if version != SERIAL_VERSION:
+            raise ValueError(f"Unsupported descriptor version: {version}")
+        offset = HEADER.size
+        values = []
+        for _ in range(4):
+            (length,) = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            values.append(bytes(data[offset:offset + length]).decode('utf-8'))
+            offset += length
+        file_id, file_unique_id, file_name, mime_type = values
+        return cls(MEDIA_KINDS[kind_index], file_id, file_unique_id, file_name, file_size, mime_type)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+JSON backend shared by the webhook and the upstream Bot API client
+Uses orjson when it is installed and falls back to the stdlib json module;
+both sides take and return bytes
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # optional faster JSON backend
+    orjson = None
+
+if orjson is not None:
+    def loads(data: bytes) -> Any:
+        return orjson.loads(data)
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+else:
+    def loads(data: bytes) -> Any:
+        # json.loads accepts bytes directly, so no separate decode step
+        return json.loads(data)
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Deduplication index for issued file links
+Maps Telegram file_unique_id to the previously issued link so repeat uploads
+are answered without calling Telegram again
+"""
+
+import os
+import sqlite3
+import time
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+from file_descriptor import FileDescriptor
+
+logger = logging.getLogger(__name__)
+
+LINK_UPSERT = (
+    "INSERT OR REPLACE INTO file_links (file_unique_id, descriptor, file_path, issued_at) VALUES (?, ?, ?, ?)"
+)
+REUSE_UPSERT = (
+    "INSERT INTO file_reuse (file_unique_id, hits) VALUES (?, ?) "
+    "ON CONFLICT(file_unique_id) DO UPDATE SET hits = hits + excluded.hits"
+)
+
+class LinkRecord(NamedTuple):
+    file_unique_id: str
+    descriptor: FileDescriptor
+    file_path: str
+    issued_at: int
+    hits: int = 0
+
+def link_row(record: LinkRecord) -> Tuple[str, bytes, str, int]:
+    return (record.file_unique_id, record.descriptor.to_bytes(), record.file_path, record.issued_at)
+
+class LinkIndex:
+    """SQLite-backed file_unique_id -> link index with a bounded in-memory LRU
+
+    Reuse counters live in their own table so they outlive the links they
+    count. New links and hits are queued in memory and written by flush() and
+    compact(), which run in a worker thread on their own connection to keep
+    disk writes off the event loop.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[int] = None, cache_size: Optional[int] = None):
+        self.path = path or os.getenv('LINK_INDEX_PATH', 'link_index.db')
+        # Bot API only guarantees a file_path for one hour, so links are reused at most that long
+        self.ttl = ttl if ttl is not None else int(os.getenv('LINK_INDEX_TTL', '3600'))
+        self.cache_size = cache_size if cache_size is not None else int(os.getenv('LINK_INDEX_CACHE_SIZE', '10000'))
+        self.cache: "OrderedDict[str, LinkRecord]" = OrderedDict()
+        # Links and reuses not yet written to disk, and those being written
+        self.pending_links: Dict[str, LinkRecord] = {}
+        self.pending_hits: Counter = Counter()
+        self.writing_links: Dict[str, LinkRecord] = {}
+
+        self.db = self._connect()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS file_links (
+                file_unique_id TEXT PRIMARY KEY,
+                descriptor BLOB NOT NULL,
+                file_path TEXT NOT NULL,
+                issued_at INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS file_reuse (
+                file_unique_id TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self.db.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=5.0)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def get(self, file_unique_id: str) -> Optional[LinkRecord]:
+        """Return the live record for a file and count the reuse, or None"""
+        record = self.cache.get(file_unique_id)
+        if record is None:
+            record = self.pending_links.get(file_unique_id) or self.writing_links.get(file_unique_id)
+            if record is not None:
+                record = record._replace(hits=record.hits + self.pending_hits[file_unique_id])
+        if record is None:
+            row = self.db.execute(
+                "SELECT l.descriptor, l.file_path, l.issued_at, COALESCE(r.hits, 0) FROM file_links l "
+                "LEFT JOIN file_reuse r ON r.file_unique_id = l.file_unique_id WHERE l.file_unique_id = ?",
+                (file_unique_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            descriptor, file_path, issued_at, hits = row
+            record = LinkRecord(
+                file_unique_id, FileDescriptor.from_bytes(descriptor), file_path, issued_at,
+                hits + self.pending_hits[file_unique_id]
+            )
+
+        if time.time() - record.issued_at > self.ttl:
+            self.cache.pop(file_unique_id, None)
+            return None
+
+        record = record._replace(hits=record.hits + 1)
+        self.pending_hits[file_unique_id] += 1
+        self._remember(record)
+        return record
+
+    def put(self, record: LinkRecord):
+        """Store a freshly issued link; it reaches disk with the next flush()"""
+        self.pending_links[record.file_unique_id] = record
+        self._remember(record)
+
+    def _remember(self, record: LinkRecord):
+        """Insert into the LRU, evicting the least recently used entries"""
+        self.cache[record.file_unique_id] = record
+        self.cache.move_to_end(record.file_unique_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def flush(self):
+        """Write queued links and reuse counts to disk"""
+        if self.pending_links or self.pending_hits:
+            await self._maintain(None)
+
+    async def compact(self) -> Tuple[int, Dict[str, int]]:
+        """Flush queued writes and drop expired links, returning (removed, reuse stats)"""
+        cutoff = int(time.time()) - self.ttl
+        result = await self._maintain(cutoff)
+        for key in [k for k, r in self.cache.items() if r.issued_at < cutoff]:
+            del self.cache[key]
+        return result
+
+    async def _maintain(self, cutoff: Optional[int]) -> Tuple[int, Dict[str, int]]:
+        links, self.pending_links = self.pending_links, {}
+        hits, self.pending_hits = self.pending_hits, Counter()
+        # Links stay visible to get() until they are committed
+        self.writing_links = links
+        try:
+            if self.path == ':memory:':
+                # A second connection would open a different database
+                return self._write(self.db, links, hits, cutoff)
+            return await asyncio.to_thread(self._write, None, links, hits, cutoff)
+        except BaseException:
+            # Keep what was not written for the next flush
+            for key, record in links.items():
+                self.pending_links.setdefault(key, record)
+            self.pending_hits.update(hits)
+            raise
+        finally:
+            self.writing_links = {}
+
+    def _write(self, db: Optional[sqlite3.Connection], links: Dict[str, LinkRecord], hits: Counter,
+               cutoff: Optional[int]) -> Tuple[int, Dict[str, int]]:
+        own = db is None
+        db = db or self._connect()
+        try:
+            db.executemany(LINK_UPSERT, (link_row(record) for record in links.values()))
+            db.executemany(REUSE_UPSERT, hits.items())
+            removed = 0
+            if cutoff is not None:
+                removed = db.execute("DELETE FROM file_links WHERE issued_at < ?", (cutoff,)).rowcount
+            db.commit()
+            return removed, self._reuse_stats(db)
+        finally:
+            if own:
+                db.close()
+
+    async def reuse_stats(self) -> Dict[str, int]:
+        """Flush queued writes and return link reuse counters for analytics"""
+        _, stats = await self._maintain(None)
+        return stats
+
+    def _reuse_stats(self, db: sqlite3.Connection) -> Dict[str, int]:
+        (entries,) = db.execute("SELECT COUNT(*) FROM file_links").fetchone()
+        reused, total_hits = db.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM file_reuse").fetchone()
+        return {"entries": entries, "reused_files": reused, "total_reuses": total_hits}
+
+    def close(self):
+        """Write queued links and reuse counts and close the underlying database"""
+        links, self.pending_links = self.pending_links, {}
+        hits, self.pending_hits = self.pending_hits, Counter()
+        self.db.executemany(LINK_UPSERT, (link_row(record) for record in links.values()))
+        self.db.executemany(REUSE_UPSERT, hits.items())
+        self.db.commit()
+        self.db.close()
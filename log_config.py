@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Logging setup shared by the bot, web server and entry point
+Records are queued on the calling thread and formatted and written by a
+background listener, so log I/O never runs on the event loop. The queue is
+bounded: when the sink cannot keep up, records are dropped and counted
+rather than piling up in memory
+"""
+
+import os
+import re
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Request/message id attached to every record logged while handling it
+request_id: contextvars.ContextVar[str] = contextvars.ContextVar('request_id', default='-')
+
+# Bot tokens, as they appear in Bot API URLs and configuration
+TOKEN_PATTERN = re.compile(r'\d{5,}:[A-Za-z0-9_-]{30,}')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+# Records held while the sink catches up; further records are dropped
+DEFAULT_QUEUE_SIZE = 10000
+
+# Only used for its formatException, on the calling thread
+EXCEPTION_FORMATTER = logging.Formatter()
+
+_listener: Optional[QueueListener] = None
+_handler: Optional["BoundedQueueHandler"] = None
+
+def redact(text: str) -> str:
+    """Mask bot tokens in a log line"""
+    return TOKEN_PATTERN.sub('<redacted>', text)
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+class SuccessSampler(logging.Filter):
+    """Keeps only a fraction of high-volume success records
+
+    Records opt in with extra={'sampled': True}; uvicorn access logs for
+    non-error responses are sampled too.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        sampled = getattr(record, 'sampled', False)
+        if not sampled and record.name == 'uvicorn.access' and record.args and len(record.args) >= 5:
+            sampled = isinstance(record.args[4], int) and record.args[4] < 400
+        return not sampled or self.rate >= 1 or random.random() < self.rate
+
+class BoundedQueueHandler(QueueHandler):
+    """Enqueues self-contained records, dropping them while the queue is full
+
+    prepare() resolves the message and traceback text on the calling thread so
+    queued records do not keep args, tracebacks or frame locals alive. Final
+    formatting and redaction still happen on the listener thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.unreported = 0
+        self.drop_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.drop_lock:
+                self.dropped += 1
+                self.unreported += 1
+            return
+        if self.unreported:
+            self.report_drops()
+
+    def report_drops(self, block: bool = False):
+        """Queue a warning with the number of records dropped since the last one"""
+        with self.drop_lock:
+            count, self.unreported = self.unreported, 0
+        if not count:
+            return
+        notice = logging.LogRecord(
+            __name__, logging.WARNING, __file__, 0,
+            "Log queue full, dropped %d records", (count,), None
+        )
+        notice.request_id = '-'
+        try:
+            self.queue.put(self.prepare(notice), block=block)
+        except queue.Full:
+            with self.drop_lock:
+                self.unreported += count
+
+class DrainingListener(QueueListener):
+    """Queue listener whose stop() waits for room in a full queue"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+class RedactingFormatter(logging.Formatter):
+    """Plain text formatter that masks bot tokens"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with bot tokens masked"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, 'request_id', '-'),
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return redact(json.dumps(entry, ensure_ascii=False))
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None,
+                  sample_rate: Optional[float] = None, stream=None,
+                  queue_size: Optional[int] = None) -> QueueListener:
+    """Route all logging through a queue drained by a background thread (idempotent)"""
+    global _listener, _handler
+    if _listener is not None:
+        return _listener
+
+    level = level or os.getenv('LOG_LEVEL', 'INFO')
+    fmt = fmt or os.getenv('LOG_FORMAT', 'text')
+    if sample_rate is None:
+        sample_rate = float(os.getenv('LOG_SUCCESS_SAMPLE_RATE', '0.1'))
+    if queue_size is None:
+        queue_size = int(os.getenv('LOG_QUEUE_SIZE', str(DEFAULT_QUEUE_SIZE)))
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else RedactingFormatter(TEXT_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    handler = BoundedQueueHandler(log_queue)
+    handler.addFilter(SuccessSampler(sample_rate))
+    handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    # Let uvicorn's loggers propagate into the queue instead of writing directly
+    for name in ('uvicorn', 'uvicorn.error', 'uvicorn.access'):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+
+    _handler = handler
+    _listener = DrainingListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener, _handler
+    if _listener is not None:
+        _handler.report_drops(block=True)
+        _listener.stop()
+        _listener = None
+        _handler = None
+
+def dropped_records() -> int:
+    """Records dropped because the log queue was full"""
+    return _handler.dropped if _handler is not None else 0
@@ -5,48 +5,41 @@ Runs both the Telegram bot and FastAPI server
 """
 
 import asyncio
-import os
 import logging
-import threading
 from bot import bot
-from server import app
-import uvicorn
+from server import config, serve
+from log_config import setup_logging
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-def run_server():
-    """Run FastAPI server in a separate thread"""
-    port = int(os.getenv('PORT', 5000))
-    uvicorn.run(
-        app, 
-        host="0.0.0.0", 
-        port=port,
-        log_level="info"
-    )
-
-async def run_bot():
-    """Run Telegram bot"""
-    try:
-        await bot.run()
-    except Exception as e:
-        logger.error(f"Bot error: {e}")
-
 async def main():
     """Main application entry point"""
     logger.info("Starting Telegram File Link Generator...")
     
-    # Start FastAPI server in a separate thread
-    server_thread = threading.Thread(target=run_server, daemon=True)
-    server_thread.start()
-    logger.info("FastAPI server started on port 5000")
+    # Run the bot alongside the server on the same event loop
+    bot_task = asyncio.create_task(bot.run())
+    server_stop = asyncio.Event()
+    logger.info("FastAPI server starting on port %d", config.port)
+    # serve() returns after SIGTERM once active streams have drained
+    server_task = asyncio.create_task(serve(server_stop))
+    
+    await asyncio.wait({bot_task, server_task}, return_when=asyncio.FIRST_COMPLETED)
+    
+    if bot_task.done():
+        # The bot only returns after stop(), so any exit here is a failure:
+        # drain the server and exit non-zero so the orchestrator restarts us
+        error = bot_task.exception() if not bot_task.cancelled() else None
+        logger.error("Bot stopped unexpectedly, shutting down: %s", error, exc_info=error)
+        server_stop.set()
+        await server_task
+        raise SystemExit(1)
     
-    # Run the bot in the main thread
-    await run_bot()
+    bot.stop()
+    await bot_task
+    # Surface server errors after the bot has shut down cleanly
+    server_task.result()
 
 if __name__ == "__main__":
     try:
@@ -54,4 +47,5 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("Application stopped by user")
     except Exception as e:
-        logger.error(f"Application error: {e}")
\ No newline at end of file
+        logger.error("Application error: %s", e)
+        raise SystemExit(1)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Resilience layer for upstream Telegram calls
+Jittered exponential retries, hedged attempts for idempotent reads, per-DC
+circuit breakers and deadlines carried over from the incoming request
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import aiohttp
+
+from file_descriptor import file_dc
+from json_backend import loads
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+class UpstreamError(Exception):
+    """Non-success HTTP response from Telegram"""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"Upstream returned {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open"""
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """The request deadline ran out before the upstream call succeeded"""
+
+class Deadline:
+    """Absolute point in time by which a request must be answered"""
+
+    def __init__(self, timeout: float):
+        self.expires = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return max(self.expires - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release_probe(self):
+        """Give up a half-open probe without a verdict, letting the next call probe"""
+        self.probing = False
+
+def is_retryable(exc: BaseException, idempotent: bool) -> bool:
+    """Whether a failed attempt may be repeated"""
+    if isinstance(exc, UpstreamError):
+        # 429 means the request was not processed; 5xx may have been for writes
+        return exc.status == 429 or (idempotent and exc.status >= 500)
+    if isinstance(exc, aiohttp.ClientConnectorError):
+        return True
+    if idempotent and isinstance(exc, (asyncio.TimeoutError, aiohttp.ClientError, OSError)):
+        return True
+    return False
+
+def upstream_key(file_id: str) -> str:
+    """Circuit breaker key for a file: the data center it lives in"""
+    return f"dc{file_dc(file_id) or 0}"
+
+async def bot_api_error(resp: aiohttp.ClientResponse) -> UpstreamError:
+    """Build an UpstreamError from a failed Bot API response, keeping retry_after"""
+    try:
+        data = await resp.json(content_type=None)
+        retry_after = data.get('parameters', {}).get('retry_after')
+    except Exception:
+        retry_after = None
+    return UpstreamError(resp.status, retry_after)
+
+async def get_file(session: aiohttp.ClientSession, api_url: str, bot_token: str, file_id: str) -> Dict:
+    """One Bot API getFile attempt, returning the File object"""
+    async with session.get(f"{api_url}/bot{bot_token}/getFile", params={'file_id': file_id}) as resp:
+        if resp.status != 200:
+            raise await bot_api_error(resp)
+        data = loads(await resp.read())
+        if not data.get('ok') or 'result' not in data:
+            raise UpstreamError(data.get('error_code', 502))
+        return data['result']
+
+class Resilience:
+    """Runs upstream calls with retries, hedging and per-key circuit breakers"""
+
+    def __init__(self, max_attempts: Optional[int] = None, base_delay: float = 0.2, max_delay: float = 5.0,
+                 attempt_timeout: Optional[float] = None, hedge: Optional[bool] = None,
+                 failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None):
+        self.max_attempts = max_attempts or int(os.getenv('UPSTREAM_MAX_ATTEMPTS', '4'))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempt_timeout = attempt_timeout or float(os.getenv('UPSTREAM_ATTEMPT_TIMEOUT', '10'))
+        self.hedge = hedge if hedge is not None else os.getenv('UPSTREAM_HEDGE', '1') == '1'
+        self.failure_threshold = failure_threshold or int(os.getenv('BREAKER_FAILURES', '5'))
+        self.reset_timeout = reset_timeout or float(os.getenv('BREAKER_RESET', '30'))
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        # Recent successful attempt latencies, used to pick the hedge delay
+        self.latencies: Deque[float] = deque(maxlen=200)
+        self.calls = 0
+        self.hedges = 0
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return self.breakers[key]
+
+    def hedge_delay(self) -> float:
+        """Launch a hedge once an attempt is slower than the recent p95"""
+        if len(self.latencies) < 20:
+            return min(1.0, self.attempt_timeout / 2)
+        ordered = sorted(self.latencies)
+        p95 = ordered[int(len(ordered) * 0.95) - 1]
+        return min(max(p95, 0.05), self.attempt_timeout / 2)
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def call(self, key: str, operation: Callable[[], Awaitable[T]], deadline: Deadline,
+                   idempotent: bool = False, discard: Optional[Callable[[T], None]] = None) -> T:
+        """Run operation() until it succeeds, the deadline passes or retries run out
+
+        discard releases the result of a hedged attempt that lost the race.
+        """
+        breaker = self.breaker(key)
+        self.calls += 1
+        last_error: BaseException = DeadlineExceeded(f"Deadline exceeded calling {key}")
+
+        for attempt in range(self.max_attempts):
+            if deadline.expired:
+                break
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {key}")
+            # allow() only sets probing when this call took the half-open probe
+            probe = breaker.probing
+
+            timeout = min(self.attempt_timeout, deadline.remaining())
+            started = time.monotonic()
+            try:
+                if idempotent and self.hedge:
+                    result = await self._hedged(operation, timeout, discard)
+                else:
+                    result = await asyncio.wait_for(operation(), timeout)
+            except Exception as e:
+                last_error = e
+                if isinstance(e, UpstreamError) and e.status < 500 and e.status != 429:
+                    # Telegram answered; client errors say nothing about its health
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                if not is_retryable(e, idempotent):
+                    raise
+                delay = self.backoff(attempt)
+                if isinstance(e, UpstreamError) and e.retry_after:
+                    delay = max(delay, e.retry_after)
+                if attempt + 1 >= self.max_attempts or delay >= deadline.remaining():
+                    break
+                logger.warning("Retrying %s after %s (attempt %d, %.2fs)", key, e, attempt + 1, delay)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled mid-attempt: say nothing about upstream health, but
+                # never leave the breaker waiting on a probe that will not report
+                if probe:
+                    breaker.release_probe()
+                raise
+
+            breaker.record_success()
+            self.latencies.append(time.monotonic() - started)
+            return result
+
+        raise last_error
+
+    async def _hedged(self, operation: Callable[[], Awaitable[T]], timeout: float,
+                      discard: Optional[Callable[[T], None]]) -> T:
+        """Run one attempt, racing a second copy if the first is slow"""
+        started = time.monotonic()
+        first = asyncio.ensure_future(asyncio.wait_for(operation(), timeout))
+        try:
+            done, _ = await asyncio.wait({first}, timeout=self.hedge_delay())
+        except BaseException:
+            # asyncio.wait does not cancel what it waits on
+            first.cancel()
+            raise
+        remaining = timeout - (time.monotonic() - started)
+        # Hedge at most one in ten calls so an overloaded upstream is not doubled
+        if done or remaining <= 0 or self.hedges * 10 >= self.calls:
+            return await first
+
+        self.hedges += 1
+        second = asyncio.ensure_future(asyncio.wait_for(operation(), remaining))
+        pending = {first, second}
+        winner: Optional[asyncio.Future] = None
+        error: Optional[BaseException] = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+                    elif discard:
+                        discard(task.result())
+            if winner is None:
+                raise error
+            return winner.result()
+        finally:
+            for task in pending:
+                task.cancel()
+                if discard:
+                    task.add_done_callback(
+                        lambda t: discard(t.result()) if not t.cancelled() and t.exception() is None else None
+                    )
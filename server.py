@@ -6,19 +6,29 @@ Serves streaming pages and handles file links
 
 import os
 import hmac
-import hashlib
 import time
-from urllib.parse import unquote
-from typing import Optional
+import asyncio
+import signal
+import contextlib
+import hashlib
+import re
+import uuid
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+from typing import Any, AsyncIterator, Dict, NamedTuple, Optional, Tuple
 import aiofiles
+import aiohttp
 import logging
 from fastapi import FastAPI, Request, HTTPException, Response
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
+from file_descriptor import FileDescriptor, url_signature
+from log_config import request_id, setup_logging
+from resilience import CircuitOpenError, Deadline, DeadlineExceeded, Resilience, UpstreamError, get_file, upstream_key
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
@@ -32,10 +42,136 @@ class FileServerConfig:
         self.url_secret = os.getenv('URL_SECRET', 'default-secret-key-change-me')
         self.bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
         self.base_url = os.getenv('BASE_URL', 'https://your-bot-name.koyeb.app')
+        self.api_url = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
         self.port = int(os.getenv('PORT', 5000))
+        # Seconds active streams may keep running after SIGTERM
+        self.drain_timeout = float(os.getenv('DRAIN_TIMEOUT', 300))
+        # Retry-After hint sent to streams refused while draining
+        self.drain_retry_after = int(os.getenv('DRAIN_RETRY_AFTER', 5))
+        # Seconds a request may spend on Telegram calls, across all retries
+        self.request_deadline = float(os.getenv('REQUEST_DEADLINE', 15))
 
 config = FileServerConfig()
 
+# Client-supplied request ids are only trusted if they look like one
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    """Tag logs and the response with a per-request id"""
+    rid = request.headers.get('x-request-id', '')
+    if not REQUEST_ID_PATTERN.match(rid):
+        rid = uuid.uuid4().hex[:12]
+    token = request_id.set(rid)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id.reset(token)
+    response.headers['X-Request-ID'] = rid
+    return response
+
+# Upstream read size for proxied file bytes
+STREAM_CHUNK_SIZE = 256 * 1024
+# Response headers passed through from Telegram for proxied bytes
+PROXY_HEADERS = ('Content-Length', 'Content-Range', 'Last-Modified')
+# Signed links are valid for 24 hours
+LINK_LIFETIME = 86400
+# Resolved files are cached for the hour Bot API guarantees file_path for
+FILE_CACHE_TTL = 3600
+FILE_CACHE_SIZE = 10000
+
+class FileLocation(NamedTuple):
+    """A file's shared descriptor and the file_path its bytes are fetched from"""
+    descriptor: FileDescriptor
+    file_path: str
+
+class DrainState:
+    """Tracks active streams and the shutdown deadline"""
+    
+    def __init__(self):
+        self.draining = False
+        self.deadline = 0.0
+        self.active_streams = 0
+    
+    def begin(self, timeout: float):
+        self.draining = True
+        self.deadline = time.monotonic() + timeout
+    
+    @property
+    def expired(self) -> bool:
+        return self.draining and time.monotonic() >= self.deadline
+    
+    async def wait_idle(self, poll_interval: float = 0.1):
+        """Wait until every stream has finished or the deadline has passed"""
+        while self.active_streams and not self.expired:
+            await asyncio.sleep(poll_interval)
+
+class ActiveStream:
+    """One /stream request, counted as active from admission until closed"""
+    
+    def __init__(self):
+        self.upstream: Optional[aiohttp.ClientResponse] = None
+        self.closed = False
+        drain.active_streams += 1
+    
+    def close(self):
+        """Release the upstream response and stop counting; safe to call twice"""
+        if self.closed:
+            return
+        self.closed = True
+        drain.active_streams -= 1
+        if self.upstream is not None:
+            self.upstream.release()
+
+class ProxyResponse(StreamingResponse):
+    """Relays an ActiveStream, closing it however the response ends
+    
+    The body generator never runs if the client leaves before it starts, and
+    background tasks are skipped on disconnect, so neither can own the close.
+    """
+    
+    def __init__(self, stream: ActiveStream, **kwargs):
+        super().__init__(relay_upstream(stream), **kwargs)
+        self.stream = stream
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.stream.close()
+
+drain = DrainState()
+resilience = Resilience()
+http_session: Optional[aiohttp.ClientSession] = None
+# file_id -> (fetched_at, resolved file)
+file_cache: "OrderedDict[str, Tuple[float, FileLocation]]" = OrderedDict()
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Return the shared upstream session, creating it on first use"""
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60))
+    return http_session
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open(request: Request, exc: CircuitOpenError):
+    """Fail fast while Telegram is known to be unhealthy"""
+    logger.warning("Refusing %s: %s", request.url.path, exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Telegram is unavailable, please retry"},
+        headers={"Retry-After": str(int(resilience.reset_timeout))}
+    )
+
+@app.exception_handler(UpstreamError)
+@app.exception_handler(DeadlineExceeded)
+@app.exception_handler(asyncio.TimeoutError)
+@app.exception_handler(aiohttp.ClientError)
+async def upstream_failed(request: Request, exc: Exception):
+    """Telegram kept failing until retries or the request deadline ran out"""
+    logger.error("Upstream failure for %s: %r", request.url.path, exc)
+    return JSONResponse(status_code=502, content={"detail": "Could not fetch file from Telegram"})
+
 @app.get("/", response_class=HTMLResponse)
 async def home():
     """Landing page with instructions"""
@@ -167,39 +303,131 @@ async def home():
     """
     return HTMLResponse(content=html_content)
 
-@app.get("/watch/{file_id}/{filename}")
-async def stream_file(file_id: str, filename: str, hash: str, t: str):
+@app.api_route("/watch/{file_id}/{filename}", methods=["GET", "HEAD"])
+async def stream_file(request: Request, file_id: str, filename: str, hash: str, t: str):
     """Stream file through web player"""
     
     # Verify the hash
     if not verify_url_hash(file_id, hash, t):
         raise HTTPException(status_code=403, detail="Invalid or expired link")
     
-    # Get file path from hash or reconstruct
-    file_path = await get_file_path_from_telegram(file_id)
-    if not file_path:
+    # Get file metadata from Telegram
+    location = await resolve_file(file_id, unquote(filename), Deadline(config.request_deadline))
+    if not location:
         raise HTTPException(status_code=404, detail="File not found")
     
-    # Generate direct Telegram CDN URL
-    telegram_file_url = f"https://api.telegram.org/file/bot{config.bot_token}/{file_path}"
+    descriptor = location.descriptor
+    decoded_filename = descriptor.file_name
     
-    # Decode filename
-    decoded_filename = unquote(filename)
+    # Players load bytes through our proxy so streams can be drained and resumed
+    telegram_file_url = f"/stream/{file_id}/{quote(decoded_filename)}?hash={hash}&t={t}"
     
     # Determine file type for appropriate player
-    file_ext = decoded_filename.lower().split('.')[-1] if '.' in decoded_filename else ''
+    player = descriptor.player
     
-    if file_ext in ['mp4', 'webm', 'mov', 'avi', 'mkv']:
+    if player == 'video':
         player_html = get_video_player_html(telegram_file_url, decoded_filename)
-    elif file_ext in ['mp3', 'wav', 'ogg', 'aac', 'flac']:
+    elif player == 'audio':
         player_html = get_audio_player_html(telegram_file_url, decoded_filename)
-    elif file_ext in ['jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp']:
+    elif player == 'image':
         player_html = get_image_player_html(telegram_file_url, decoded_filename)
     else:
         # For documents and other files, redirect to download
         return RedirectResponse(url=telegram_file_url)
     
-    return HTMLResponse(content=player_html)
+    # The page depends on the file and on the link it was rendered for
+    page_digest = hashlib.sha256(player_html.encode()).hexdigest()[:16]
+    headers = cache_headers(make_etag(descriptor, page_digest), t)
+    if etag_matches(request.headers.get('if-none-match'), headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    
+    return HTMLResponse(content=player_html, headers=headers)
+
+@app.api_route("/stream/{file_id}/{filename}", methods=["GET", "HEAD"])
+async def proxy_file(request: Request, file_id: str, filename: str, hash: str, t: str):
+    """Proxy file bytes from Telegram, honouring Range requests"""
+    
+    # Verify the hash
+    if not verify_url_hash(file_id, hash, t):
+        raise HTTPException(status_code=403, detail="Invalid or expired link")
+    
+    # New streams belong on another instance once we are draining
+    if drain.draining:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is restarting, please retry"},
+            headers={"Retry-After": str(config.drain_retry_after)}
+        )
+    
+    # Counted from admission, so a drain also waits for streams still in getFile
+    stream = ActiveStream()
+    try:
+        # getFile and opening the upstream share one deadline
+        deadline = Deadline(config.request_deadline)
+        location = await resolve_file(file_id, unquote(filename), deadline)
+        if not location:
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        # Telegram files never change, so the ETag is the file's unique id
+        descriptor = location.descriptor
+        validators = cache_headers(make_etag(descriptor), t)
+        if etag_matches(request.headers.get('if-none-match'), validators['ETag']):
+            stream.close()
+            return Response(status_code=304, headers=validators)
+        
+        upstream_headers = {}
+        if 'range' in request.headers and if_range_allows(request.headers.get('if-range'), validators['ETag']):
+            upstream_headers['Range'] = request.headers['range']
+        
+        session = await get_http_session()
+        
+        async def open_upstream() -> aiohttp.ClientResponse:
+            upstream = await session.get(
+                f"{config.api_url}/file/bot{config.bot_token}/{location.file_path}",
+                headers=upstream_headers
+            )
+            if upstream.status not in (200, 206, 416):
+                upstream.release()
+                raise UpstreamError(upstream.status)
+            return upstream
+        
+        # Only the response headers are awaited here; the body is relayed below
+        stream.upstream = await resilience.call(
+            upstream_key(file_id), open_upstream, deadline,
+            idempotent=True, discard=lambda response: response.release()
+        )
+    except BaseException:
+        stream.close()
+        raise
+    
+    upstream = stream.upstream
+    headers = {name: upstream.headers[name] for name in PROXY_HEADERS if name in upstream.headers}
+    headers['Accept-Ranges'] = 'bytes'
+    if upstream.status != 416:
+        headers.update(validators)
+    if request.method == 'HEAD':
+        # Headers only, for CDNs probing size and validators; the body is never read
+        stream.close()
+        return Response(status_code=upstream.status, headers=headers, media_type=descriptor.content_type)
+    logger.info("Streaming %s (%d)", file_id, upstream.status, extra={'sampled': True})
+    return ProxyResponse(
+        stream,
+        status_code=upstream.status,
+        headers=headers,
+        media_type=descriptor.content_type
+    )
+
+async def relay_upstream(stream: ActiveStream) -> AsyncIterator[bytes]:
+    """Relay upstream bytes, stopping early if the drain deadline passes"""
+    try:
+        async for chunk in stream.upstream.content.iter_chunked(STREAM_CHUNK_SIZE):
+            yield chunk
+            if drain.expired:
+                # The client sees a short body and resumes elsewhere with Range
+                logger.info("Drain deadline reached, closing active stream")
+                break
+    finally:
+        stream.close()
 
 def verify_url_hash(file_id: str, provided_hash: str, timestamp: str) -> bool:
     """Verify the URL hash for security"""
@@ -207,26 +435,94 @@ def verify_url_hash(file_id: str, provided_hash: str, timestamp: str) -> bool:
         # Check if timestamp is within 24 hours (86400 seconds)
         current_time = int(time.time())
         link_time = int(timestamp)
-        if current_time - link_time > 86400:  # 24 hours
+        if current_time - link_time > LINK_LIFETIME:
             return False
         
         # Generate expected hash
-        hash_string = f"{file_id}:unknown:{timestamp}:{config.url_secret}"
-        expected_hash = hmac.new(
-            config.url_secret.encode(),
-            hash_string.encode(),
-            hashlib.sha256
-        ).hexdigest()[:16]
+        expected_hash = generate_url_hash(file_id, timestamp)
         
         return hmac.compare_digest(expected_hash, provided_hash)
     except:
         return False
 
-async def get_file_path_from_telegram(file_id: str) -> Optional[str]:
-    """Get file path from Telegram API (simplified for this example)"""
-    # In a real implementation, you'd need to use the Telegram Bot API
-    # For now, we'll return a placeholder that works with the bot
-    return f"documents/{file_id}"
+def generate_url_hash(file_id: str, timestamp: str) -> str:
+    """Generate the URL hash expected for a watch link"""
+    return url_signature(file_id, timestamp, config.url_secret)
+
+async def lookup_file(file_id: str, deadline: Deadline) -> Optional[Dict[str, Any]]:
+    """Bot API getFile, giving the file_path that /stream fetches bytes from
+    
+    Returns None if Telegram rejects the file_id; outages raise instead.
+    """
+    session = await get_http_session()
+    try:
+        result = await resilience.call(
+            upstream_key(file_id),
+            lambda: get_file(session, config.api_url, config.bot_token, file_id),
+            deadline,
+            idempotent=True
+        )
+    except UpstreamError as e:
+        if e.status >= 500 or e.status == 429:
+            raise
+        logger.info("Telegram rejected %s (%d)", file_id, e.status)
+        return None
+    return result if result.get('file_path') else None
+
+async def resolve_file(file_id: str, file_name: str, deadline: Deadline) -> Optional[FileLocation]:
+    """Descriptor and file_path for a linked file, cached while the file_path stays valid"""
+    cached = file_cache.get(file_id)
+    if cached and time.monotonic() - cached[0] < FILE_CACHE_TTL:
+        file_cache.move_to_end(file_id)
+        location = cached[1]
+    else:
+        result = await lookup_file(file_id, deadline)
+        if not result:
+            return None
+        descriptor = FileDescriptor.from_link(
+            file_id, file_name, result.get('file_unique_id', ''), result.get('file_size', 0)
+        )
+        location = FileLocation(descriptor, result['file_path'])
+        file_cache[file_id] = (time.monotonic(), location)
+        file_cache.move_to_end(file_id)
+        while len(file_cache) > FILE_CACHE_SIZE:
+            file_cache.popitem(last=False)
+    
+    descriptor = location.descriptor
+    if descriptor.file_name != file_name:
+        # The name comes from the link and only affects rendering; the file is the same
+        renamed = FileDescriptor.from_link(file_id, file_name, descriptor.file_unique_id, descriptor.file_size)
+        location = location._replace(descriptor=renamed)
+    return location
+
+def make_etag(descriptor: FileDescriptor, variant: str = '') -> str:
+    """Strong ETag derived from the file's unique id"""
+    tag = descriptor.file_unique_id or descriptor.file_id
+    return f'"{tag}-{variant}"' if variant else f'"{tag}"'
+
+def cache_headers(etag: str, timestamp: str) -> Dict[str, str]:
+    """Caching headers for content behind a signed link"""
+    # Content is immutable, but caches must not outlive the link itself
+    remaining = max(LINK_LIFETIME - (int(time.time()) - int(timestamp)), 0)
+    return {
+        'ETag': etag,
+        'Cache-Control': f"public, max-age={remaining}, immutable",
+    }
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against our ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+def if_range_allows(if_range: Optional[str], etag: str) -> bool:
+    """Whether a Range request may be honoured given its If-Range header"""
+    if not if_range:
+        return True
+    # Only a strong match with our ETag keeps the range; dates and stale tags get the full file
+    return if_range.strip() == etag
 
 def get_video_player_html(file_url: str, filename: str) -> str:
     """Generate HTML for video player"""
@@ -385,14 +681,69 @@ def get_image_player_html(file_url: str, filename: str) -> str:
 # Health check endpoint for Vercel
 @app.get("/health")
 async def health_check():
+    if drain.draining:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "draining", "service": "telegram-file-link-generator", "active_streams": drain.active_streams}
+        )
     return {"status": "healthy", "service": "telegram-file-link-generator"}
 
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that leaves SIGTERM/SIGINT handling to serve()"""
+    
+    def install_signal_handlers(self):
+        pass
+    
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
+
+async def serve(stop_event: Optional[asyncio.Event] = None):
+    """Run the web server, draining active streams on SIGTERM before exiting
+    
+    Setting stop_event starts the same drain as SIGTERM.
+    """
+    server = DrainingServer(uvicorn.Config(
+        app,
+        host="0.0.0.0",
+        port=config.port,
+        log_level="info",
+        log_config=None,  # uvicorn logs go through the shared queue
+        timeout_graceful_shutdown=5
+    ))
+    
+    async def shutdown():
+        drain.begin(config.drain_timeout)
+        logger.info("Draining %d active streams (deadline %.0fs)", drain.active_streams, config.drain_timeout)
+        await drain.wait_idle()
+        logger.info("Drain complete, stopping server")
+        server.should_exit = True
+    
+    def handle_signal():
+        if drain.draining:
+            # A second signal skips the remaining drain
+            server.force_exit = True
+            server.should_exit = True
+            return
+        asyncio.ensure_future(shutdown())
+    
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, handle_signal)
+    
+    async def watch_stop_event():
+        await stop_event.wait()
+        handle_signal()
+    
+    watcher = asyncio.create_task(watch_stop_event()) if stop_event else None
+    try:
+        await server.serve()
+    finally:
+        if watcher:
+            watcher.cancel()
+        if http_session and not http_session.closed:
+            await http_session.close()
+
 # Start server
 if __name__ == "__main__":
-    port = int(os.getenv('PORT', 5000))
-    uvicorn.run(
-        "server:app", 
-        host="0.0.0.0", 
-        port=port,
-        reload=False  # Disable reload in production
-    )
\ No newline at end of file
+    asyncio.run(serve())
\ No newline at end of file
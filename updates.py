@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Lightweight Telegram update model for the webhook path
+Bodies without a message are dropped before parsing; the rest are decoded and
+reduced to the chat id, text and a typed FileDescriptor, so no raw dicts
+outlive the request handler
+"""
+
+from typing import Optional
+
+from file_descriptor import MEDIA_KINDS, FileDescriptor
+from json_backend import loads
+
+# Every update the webhook handles carries a top-level "message" object; bodies
+# without the key anywhere are dropped before parsing
+MESSAGE_MARKER = b'"message"'
+
+class WebhookUpdate:
+    """The parts of a Telegram message update used by the webhook"""
+
+    __slots__ = ('chat_id', 'text', 'file')
+
+    def __init__(self, chat_id: int, text: Optional[str] = None, file: Optional[FileDescriptor] = None):
+        self.chat_id = chat_id
+        self.text = text
+        self.file = file
+
+    @classmethod
+    def from_body(cls, body: bytes) -> Optional["WebhookUpdate"]:
+        """Parse a raw webhook body, returning None for updates the webhook ignores"""
+        if MESSAGE_MARKER not in body:
+            return None
+
+        update = loads(body)
+        message = update.get('message') if isinstance(update, dict) else None
+        if not message:
+            return None
+
+        chat_id = message['chat']['id']
+        for kind in MEDIA_KINDS:
+            media = message.get(kind)
+            if media:
+                if kind == 'photo':
+                    # Photos arrive as a list of sizes; keep the largest
+                    media = max(media, key=lambda x: x.get('file_size', 0))
+                return cls(chat_id, file=FileDescriptor.from_update(kind, media))
+
+        return cls(chat_id, text=message.get('text'))